@@ -1,13 +1,15 @@
 from django.contrib import admin
 
 from .models import (
-    Ingredient, IngredientInRecipe, Recipe, Subscription, Tag, User,
+    Ingredient, IngredientInRecipe, Recipe, ShopListJob, Subscription, Tag,
+    User,
 )
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('email', 'username', 'first_name', 'last_name')
+    list_display = ('email', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'subscribers_count')
     search_fields = ('email', 'username')
     list_filter = ('email', 'username')
     filter_horizontal = ('shopping_cart_recipes', 'favorite_recipes',)
@@ -36,7 +38,7 @@ class IngredientInlineAdmin(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'pub_date')
+    list_display = ('name', 'author', 'pub_date', 'favorites_count')
     readonly_fields = ('is_favorited',)
     inlines = (IngredientInlineAdmin,)
     search_fields = ('author__username', 'name', 'text', 'tags__slug')
@@ -45,9 +47,16 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='Число добавлений в избранное')
     def is_favorited(self, obj):
-        return obj.users_have_in_favorite.count()
+        return obj.favorites_count
 
 
 @admin.register(IngredientInRecipe)
 class IngredientInRecipeAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
+
+
+@admin.register(ShopListJob)
+class ShopListJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'created', 'finished')
+    list_filter = ('status',)
+    exclude = ('result',)
@@ -0,0 +1,125 @@
+"""
+Token authentication keeping users by tokens in memory of each worker
+and, optionally, in the shared cache, so most requests do not query the
+token and the user. A kept user is checked against the auth version of
+the user on every request, the version is bumped on logout, password
+change, deactivation and any other change of the user.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+
+from .caches import AUTH_TOKEN_STATS, get_auth_version, record
+
+TOKEN_KEY = 'auth:token:{digest}'
+# Only fields needed by permissions and views, others are loaded on access
+AUTH_USER_FIELDS = {'id', 'email', 'username', 'first_name', 'last_name',
+                    'is_active', 'is_staff', 'is_superuser'}
+STATS_FLUSH = 100
+
+User = get_user_model()
+
+
+class TokenCache:
+    """
+    Bounded LRU of users by token digests, entries expire after
+    TOKEN_CACHE_TIMEOUT seconds. Hits and misses are counted in the worker
+    and added to the shared statistics by batches
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, digest):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            snapshot, version, expires = entry
+            if expires < time.monotonic():
+                del self.entries[digest]
+                return None
+            self.entries.move_to_end(digest)
+            return snapshot, version
+
+    def set(self, digest, snapshot, version):
+        with self.lock:
+            self.entries[digest] = (
+                snapshot, version,
+                time.monotonic() + settings.TOKEN_CACHE_TIMEOUT,
+            )
+            self.entries.move_to_end(digest)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, digest):
+        with self.lock:
+            self.entries.pop(digest, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if self.hits + self.misses < STATS_FLUSH:
+                return
+        self.flush_stats()
+
+    def flush_stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        record(AUTH_TOKEN_STATS, True, hits)
+        record(AUTH_TOKEN_STATS, False, misses)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    tokens = TokenCache()
+
+    def get_cached(self, digest):
+        cached = self.tokens.get(digest)
+        if cached is None and settings.TOKEN_CACHE_SHARED:
+            cached = cache.get(TOKEN_KEY.format(digest=digest))
+            if cached is not None:
+                self.tokens.set(digest, *cached)
+        return cached
+
+    def get_user(self, snapshot):
+        """User of the snapshot, saving it writes the loaded fields only"""
+        fields = [field.attname for field in User._meta.concrete_fields
+                  if field.attname in AUTH_USER_FIELDS]
+        return User.from_db(DEFAULT_DB_ALIAS, fields,
+                            [snapshot[field] for field in fields])
+
+    def authenticate_credentials(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        cached = self.get_cached(digest)
+        if cached is not None:
+            snapshot, version = cached
+            if get_auth_version(snapshot['id']) == version:
+                self.tokens.count(hit=True)
+                user = self.get_user(snapshot)
+                return user, self.get_model()(key=key, user=user)
+            self.tokens.delete(digest)
+        self.tokens.count(hit=False)
+        user, token = super().authenticate_credentials(key)
+        version = get_auth_version(user.pk)
+        snapshot = {field: getattr(user, field) for field in AUTH_USER_FIELDS}
+        self.tokens.set(digest, snapshot, version)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set(TOKEN_KEY.format(digest=digest), (snapshot, version),
+                      timeout=settings.TOKEN_CACHE_TIMEOUT)
+        return user, token
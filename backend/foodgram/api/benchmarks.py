@@ -0,0 +1,440 @@
+"""
+Hot path benchmarks, run them with `python manage.py benchmark [name ...]`.
+Every benchmark works inside a transaction which is rolled back at the end,
+so it is safe to run against a database with real data.
+"""
+import base64
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from itertools import islice
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Value
+from django.db.models.fields import IntegerField
+from django.test import override_settings
+from fpdf import FPDF
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import utils
+from .authentication import CachedTokenAuthentication
+from .filters import IngredientFilter, RecipeFilter
+from .models import Ingredient, IngredientInRecipe, Recipe, Tag
+from .search import IngredientIndex
+from .serializers import IngredientSerializer, RecipeReadSerializer
+from .utils import aggregate_shop_list, create_shop_list
+from .views import RecipeViewSet
+
+BENCHMARK_USER_EMAIL = 'benchmark@foodgram.local'
+BENCHMARK_INGREDIENTS = 200
+BENCHMARK_INGREDIENTS_IN_RECIPE = 10
+BENCHMARK_BATCH_SIZE = 10000
+SHOP_LIST_CART_SIZES = (10, 100, 1000)
+SHOP_LIST_PDF_LINES = (10, 100, 1000)
+SHOP_LIST_PDF_RENDERS = 20
+TAG_FILTER_RECIPES = (10000, 1000000)
+TAG_FILTER_TAGS = 30
+TAG_FILTER_SELECTED = (1, 3, 10)
+TAG_FILTER_PAGE_SIZE = 10
+INGREDIENTS_CSV = os.path.join(settings.BASE_DIR, '..', '..', 'data',
+                               'ingredients.csv')
+INGREDIENT_SEARCH_QUERIES = ('с', 'са', 'сах', 'сахар', 'мол', 'перец')
+INGREDIENT_SEARCH_REPEATS = 100
+IMPORT_CSV_ROWS = (10000, 1000000)
+IMPORT_CSV_ROW_BY_ROW_LIMIT = 10000
+IMAGE_UPLOAD_SIDES = (500, 1200, 2400)
+TOKEN_AUTH_REQUESTS = 1000
+
+User = get_user_model()
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register function as a benchmark available for the command"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def rollback():
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@contextmanager
+def measure():
+    """Collect time, number of queries and peak of python memory"""
+    metrics = {'queries': 0}
+
+    def count_queries(execute, sql, params, many, context):
+        metrics['queries'] += 1
+        return execute(sql, params, many, context)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with connection.execute_wrapper(count_queries):
+        yield metrics
+    metrics['ms'] = round((time.perf_counter() - start) * 1000, 2)
+    metrics['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    tracemalloc.stop()
+
+
+def create_user(email=BENCHMARK_USER_EMAIL):
+    return User.objects.create_user(email=email,
+                                    username=email.split('@')[0],
+                                    password=email,
+                                    first_name='Benchmark',
+                                    last_name='User')
+
+
+def create_ingredients(total=BENCHMARK_INGREDIENTS):
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'benchmark ingredient {number}',
+                   measurement_unit='г')
+        for number in range(total)
+    )
+    return list(Ingredient.objects.filter(
+        name__startswith='benchmark ingredient'
+    ).values_list('id', flat=True))
+
+
+def bulk_create(model, objects):
+    """Create objects by batches not to keep all of them in memory"""
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, BENCHMARK_BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+
+def create_recipes(author, total, ingredient_ids=None):
+    """Create `total` recipes with ingredients, return their ids"""
+    bulk_create(Recipe, (
+        Recipe(author=author,
+               name=f'Benchmark recipe {number}',
+               image=f'recipes/benchmark_{author.id}_{number}.png',
+               text='Benchmark',
+               cooking_time=1)
+        for number in range(total)
+    ))
+    recipe_ids = list(Recipe.objects.filter(
+        author=author
+    ).values_list('id', flat=True))
+    if ingredient_ids:
+        bulk_create(IngredientInRecipe, (
+            IngredientInRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[
+                    (recipe_id + shift) % len(ingredient_ids)
+                ],
+                amount=shift + 1,
+            )
+            for recipe_id in recipe_ids
+            for shift in range(BENCHMARK_INGREDIENTS_IN_RECIPE)
+        ))
+    return recipe_ids
+
+
+def serialize_shop_list(user):
+    """Former shopping list path: serialize each recipe, sum in python"""
+    ingredients = {}
+    for recipe in RecipeReadSerializer(
+        Recipe.objects.filter(
+            users_have_in_shopping_cart=user
+        ).annotate(
+            is_favorited=Value(0, output_field=IntegerField()),
+            is_in_shopping_cart=Value(1, output_field=IntegerField()),
+        ).prefetch_related('tags', 'ingredients'),
+        many=True,
+    ).data:
+        for ingredient in recipe['ingredients']:
+            key = (ingredient['name'], ingredient['measurement_unit'])
+            ingredients[key] = (ingredients.setdefault(key, 0)
+                                + ingredient['amount'])
+    return ingredients
+
+
+@benchmark('shop_list')
+def shop_list_benchmark():
+    for cart_size in SHOP_LIST_CART_SIZES:
+        with rollback():
+            user = create_user()
+            user.shopping_cart_recipes.add(
+                *create_recipes(user, cart_size, create_ingredients())
+            )
+            with measure() as serialized:
+                serialize_shop_list(user)
+            with measure() as aggregated:
+                list(aggregate_shop_list(user))
+        yield f'{cart_size} recipes, serializer', serialized
+        yield f'{cart_size} recipes, aggregation', aggregated
+
+
+def render_shop_list_pdf(user, ingredients):
+    """Former PDF rendering: new document and font loading on every call"""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.add_font(utils.PDF_FONT_FAMILY,
+                 utils.PDF_FONT_STYLE,
+                 utils.PDF_FONT_NAME,
+                 uni=True)
+    pdf.set_font(utils.PDF_FONT_FAMILY, size=utils.PDF_FONT_SIZE)
+    pdf.cell(utils.PDF_CELL_WIDTH,
+             utils.PDF_CELL_HEGHT,
+             txt=utils.PDF_HEAD_LINE.format(name=user.first_name,
+                                            surname=user.last_name),
+             align=utils.PDF_ALIGN_CENTER)
+    pdf.ln(utils.PDF_LINE_BRAKE_BIG)
+    for name, unit, amount in ingredients:
+        pdf.cell(utils.PDF_CELL_WIDTH,
+                 utils.PDF_CELL_HEGHT,
+                 txt=utils.PDF_INGREDIENT_LINE.format(name=name.capitalize(),
+                                                      unit=unit,
+                                                      amount=str(amount)),
+                 align=utils.PDF_ALIGN_LEFT)
+        pdf.ln(utils.PDF_LINE_BRAKE_SMALL)
+    return pdf.output(dest=utils.PDF_OUTPUT_STRING)
+
+
+@benchmark('shop_list_pdf')
+def shop_list_pdf_benchmark():
+    user = SimpleNamespace(first_name='Benchmark', last_name='User')
+    utils.preload_shop_list_renderer()
+    for lines in SHOP_LIST_PDF_LINES:
+        ingredients = [(f'ингредиент {number}', 'г', number)
+                       for number in range(lines)]
+        for label, render in (('fresh FPDF', render_shop_list_pdf),
+                              ('preloaded renderer', create_shop_list)):
+            with measure() as metrics:
+                for _ in range(SHOP_LIST_PDF_RENDERS):
+                    render(user, ingredients)
+            metrics['ms_per_render'] = round(
+                metrics['ms'] / SHOP_LIST_PDF_RENDERS, 2
+            )
+            yield f'{lines} lines, {label}', metrics
+
+
+def create_tags(recipe_ids, total=TAG_FILTER_TAGS):
+    """Create `total` tags, put every recipe under one to three of them"""
+    Tag.objects.bulk_create(
+        Tag(name=f'benchmark tag {number}',
+            color=number,
+            slug=f'benchmark-tag-{number}')
+        for number in range(total)
+    )
+    tag_ids = list(Tag.objects.filter(
+        slug__startswith='benchmark-tag-'
+    ).values_list('id', flat=True))
+    bulk_create(Recipe.tags.through, (
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in {tag_ids[recipe_id % total],
+                       tag_ids[recipe_id * 7 % total],
+                       tag_ids[recipe_id * 13 % total]}
+    ))
+    return list(Tag.objects.filter(id__in=tag_ids))
+
+
+def filter_recipes_by_tags_distinct(queryset, tags):
+    """Former tag filter: join recipe tags and remove duplicates"""
+    return queryset.filter(
+        tags__slug__in=[tag.slug for tag in tags]
+    ).distinct()
+
+
+def filter_recipes_by_tags(queryset, tags):
+    return RecipeFilter(
+        {'tags': [tag.slug for tag in tags]},
+        queryset=queryset,
+    ).qs
+
+
+@benchmark('tag_filter')
+def tag_filter_benchmark():
+    for total in TAG_FILTER_RECIPES:
+        with rollback():
+            tags = create_tags(create_recipes(create_user(), total))
+            queryset = Recipe.objects.annotate(
+                is_favorited=Value(0, output_field=IntegerField()),
+                is_in_shopping_cart=Value(0, output_field=IntegerField()),
+            ).order_by('-pub_date')
+            results = []
+            for selected in TAG_FILTER_SELECTED:
+                for label, filter_recipes in (
+                    ('join and distinct', filter_recipes_by_tags_distinct),
+                    ('semi-join', filter_recipes_by_tags),
+                ):
+                    recipes = filter_recipes(queryset, tags[:selected])
+                    with measure() as metrics:
+                        metrics['count'] = recipes.count()
+                        list(recipes[:TAG_FILTER_PAGE_SIZE])
+                    results.append((
+                        f'{total} recipes, {selected} of {len(tags)} tags, '
+                        f'{label}',
+                        metrics,
+                    ))
+        yield from results
+
+
+def read_ingredients(file=INGREDIENTS_CSV):
+    """Ingredients of the catalog file, generated ones if there is none"""
+    if not os.path.exists(file):
+        return [(f'ингредиент {number}', 'г')
+                for number in range(BENCHMARK_INGREDIENTS * 10)]
+    with open(file, encoding='utf8') as csvfile:
+        return [tuple(row) for row in csv.reader(csvfile)]
+
+
+@benchmark('ingredient_search')
+def ingredient_search_benchmark():
+    with rollback():
+        Ingredient.objects.all().delete()
+        bulk_create(Ingredient, (
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in read_ingredients()
+        ))
+        with measure() as metrics:
+            index = IngredientIndex(Ingredient.objects.all())
+        yield f'{len(index.names)} ingredients, index build', metrics
+        for query in INGREDIENT_SEARCH_QUERIES:
+            for label, search in (
+                ('ORM istartswith', lambda: IngredientSerializer(
+                    IngredientFilter(
+                        {'name': query},
+                        queryset=Ingredient.objects.all(),
+                    ).qs,
+                    many=True,
+                ).data),
+                ('index', lambda: IngredientSerializer(
+                    index.search(query), many=True
+                ).data),
+            ):
+                with measure() as metrics:
+                    for _ in range(INGREDIENT_SEARCH_REPEATS):
+                        metrics['found'] = len(search())
+                metrics['ms_per_search'] = round(
+                    metrics['ms'] / INGREDIENT_SEARCH_REPEATS, 3
+                )
+                yield f'{query!r}, {label}', metrics
+
+
+def write_catalog(file, total):
+    """Synthetic ingredients catalog of `total` rows"""
+    writer = csv.writer(file)
+    for number in range(total):
+        writer.writerow((f'ингредиент {number}', 'г'))
+    file.flush()
+
+
+@benchmark('import_csv')
+def import_csv_benchmark():
+    for total in IMPORT_CSV_ROWS:
+        with tempfile.NamedTemporaryFile('w', encoding='utf8',
+                                         suffix='.csv') as file:
+            write_catalog(file, total)
+            if total <= IMPORT_CSV_ROW_BY_ROW_LIMIT:
+                with rollback(), measure() as metrics:
+                    with open(file.name, encoding='utf8') as csvfile:
+                        for name, unit in csv.reader(csvfile):
+                            Ingredient.objects.create(name=name,
+                                                      measurement_unit=unit)
+                metrics['rows_per_sec'] = round(total / metrics['ms'] * 1000)
+                yield f'{total} rows, create per row', metrics
+            with rollback(), measure() as metrics:
+                call_command('import_csv', file.name, verbosity=0,
+                             stdout=StringIO())
+            metrics['rows_per_sec'] = round(total / metrics['ms'] * 1000)
+            yield f'{total} rows, bulk import', metrics
+
+
+def make_noise_png(side):
+    """PNG of noise, which does not compress, about 3 bytes per pixel"""
+    buffer = BytesIO()
+    Image.frombytes('RGB', (side, side),
+                    os.urandom(side * side * 3)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def upload_recipe(user, data, format):
+    """Post the recipe, the request body is built before measuring"""
+    request = APIRequestFactory().post('/api/recipes/', data, format=format)
+    force_authenticate(request, user=user)
+    view = RecipeViewSet.as_view({'post': 'create'})
+    with measure() as metrics:
+        view(request)
+    request.close()
+    return metrics
+
+
+@benchmark('image_upload')
+def image_upload_benchmark():
+    upload_settings = override_settings(
+        RECIPE_IMAGE_MAX_SIZE=64 * 1024 * 1024,
+    )
+    with rollback(), upload_settings, tempfile.TemporaryDirectory() as root:
+        user = create_user()
+        ingredient_id = create_ingredients(1)[0]
+        tag = Tag.objects.create(name='benchmark tag', color=0,
+                                 slug='benchmark')
+        form = {
+            'tags': [tag.id],
+            'name': 'Benchmark recipe',
+            'text': 'Benchmark recipe',
+            'cooking_time': 1,
+        }
+        with override_settings(MEDIA_ROOT=root):
+            for side in IMAGE_UPLOAD_SIDES:
+                image = make_noise_png(side)
+                label = f'{len(image) // 1024} KB image'
+                yield f'{label}, multipart', upload_recipe(user, {
+                    **form,
+                    'ingredients[0]id': ingredient_id,
+                    'ingredients[0]amount': 1,
+                    'image': SimpleUploadedFile('image.png', image),
+                }, 'multipart')
+                yield f'{label}, base64 json', upload_recipe(user, {
+                    **form,
+                    'ingredients': [{'id': ingredient_id, 'amount': 1}],
+                    'image': ('data:image/png;base64,'
+                              + base64.b64encode(image).decode()),
+                }, 'json')
+
+
+@benchmark('token_auth')
+def token_auth_benchmark():
+    with rollback():
+        token = Token.objects.create(user=create_user())
+        request = APIRequestFactory().get(
+            '/api/tags/', HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        cases = (
+            ('no cache', TokenAuthentication, False),
+            ('worker cache', CachedTokenAuthentication, False),
+            ('worker and shared cache', CachedTokenAuthentication, True),
+        )
+        for label, authentication, shared in cases:
+            CachedTokenAuthentication.tokens.clear()
+            with override_settings(TOKEN_CACHE_SHARED=shared):
+                with measure() as metrics:
+                    for _ in range(TOKEN_AUTH_REQUESTS):
+                        authentication().authenticate(request)
+            metrics['us_per_request'] = round(
+                metrics['ms'] * 1000 / TOKEN_AUTH_REQUESTS, 1
+            )
+            yield f'{TOKEN_AUTH_REQUESTS} requests, {label}', metrics
@@ -0,0 +1,149 @@
+"""
+Version counters and hit/miss statistics kept in the default cache.
+Cached values include versions of data they depend on in their keys,
+so bumping a version invalidates them without explicit deletes.
+"""
+import time
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{name}'
+MODIFIED_KEY = 'modified:{name}'
+STATS_KEY = 'stats:{name}:{event}'
+STATS_EVENTS = ('hits', 'misses')
+CART_VERSION = 'cart:{user}'
+INGREDIENTS_VERSION = 'ingredients'
+RECIPES_VERSION = 'recipes'
+RECIPE_VERSION = 'recipe:{recipe}'
+TAGS_VERSION = 'tags'
+USERS_VERSION = 'users'
+USER_VERSION = 'user:{user}'
+FLAGS_VERSION = 'flags:{user}'
+AUTH_VERSION = 'auth:{user}'
+SHOP_LIST_STATS = 'shop_list'
+RESPONSE_STATS = 'response'
+RECIPE_FRAGMENT_STATS = 'recipe_fragment'
+AUTH_TOKEN_STATS = 'auth_token'
+STATS_NAMES = (SHOP_LIST_STATS, RESPONSE_STATS, RECIPE_FRAGMENT_STATS,
+               AUTH_TOKEN_STATS)
+
+User = get_user_model()
+
+
+def new_version():
+    """Versions start from the current time to never repeat after eviction"""
+    return time.time_ns()
+
+
+def get_version(name):
+    return cache.get_or_set(VERSION_KEY.format(name=name), new_version,
+                            timeout=None)
+
+
+def get_versions(*names):
+    """Get several versions in one round trip to the cache"""
+    keys = [VERSION_KEY.format(name=name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def get_validators(*names):
+    """
+    Get versions and the last time any of them was bumped, both in one
+    round trip to the cache. Unknown times are reset to now
+    """
+    keys = [VERSION_KEY.format(name=name) for name in names]
+    times = [MODIFIED_KEY.format(name=name) for name in names]
+    values = cache.get_many(keys + times)
+    now = time.time()
+    missing = {key: new_version() if key in keys else now
+               for key in keys + times if key not in values}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        values.update(missing)
+    return ([values[key] for key in keys],
+            max((values[key] for key in times), default=now))
+
+
+def bump_version(*names):
+    """
+    Bump versions once the current transaction commits, otherwise a reader
+    could cache rows it still sees as old under the new versions
+    """
+    if names:
+        transaction.on_commit(partial(bump_versions_now, names))
+
+
+def bump_versions_now(names):
+    for key in (VERSION_KEY.format(name=name) for name in names):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), timeout=None)
+    cache.set_many({MODIFIED_KEY.format(name=name): time.time()
+                    for name in names}, timeout=None)
+
+
+def get_cart_version(user_id):
+    return get_version(CART_VERSION.format(user=user_id))
+
+
+def bump_cart_version(*user_ids):
+    bump_version(*(CART_VERSION.format(user=user_id) for user_id in user_ids))
+
+
+def bump_recipe_carts(*recipe_ids):
+    """Invalidate shopping lists of everyone having recipes in the cart"""
+    bump_cart_version(*User.shopping_cart_recipes.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('user_id', flat=True))
+
+
+def bump_recipe_version(*recipe_ids):
+    bump_version(*(RECIPE_VERSION.format(recipe=recipe_id)
+                   for recipe_id in recipe_ids))
+
+
+def bump_user_version(*user_ids):
+    bump_version(*(USER_VERSION.format(user=user_id) for user_id in user_ids))
+
+
+def bump_flags_version(*user_ids):
+    """Invalidate recipe flags of users: favorites, cart and subscriptions"""
+    bump_version(*(FLAGS_VERSION.format(user=user_id)
+                   for user_id in user_ids))
+
+
+def get_auth_version(user_id):
+    return get_version(AUTH_VERSION.format(user=user_id))
+
+
+def bump_auth_version(*user_ids):
+    """Invalidate users kept by token authentication"""
+    bump_version(*(AUTH_VERSION.format(user=user_id) for user_id in user_ids))
+
+
+def record(name, hit, count=1):
+    if not count:
+        return
+    key = STATS_KEY.format(name=name, event=STATS_EVENTS[not hit])
+    if not cache.add(key, count, timeout=None):
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.set(key, count, timeout=None)
+
+
+def get_stats(name):
+    stats = {event: cache.get(STATS_KEY.format(name=name, event=event), 0)
+             for event in STATS_EVENTS}
+    total = sum(stats.values())
+    stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0
+    return stats
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+ERROR_LOCAL_CACHE = Error(
+    'The default cache is local to the process.',
+    hint='Versions of cached data, token auth versions and replica pins '
+         'are bumped by other processes too. Set CACHE_BACKEND and '
+         'CACHE_LOCATION to a shared cache, memcached in docker-compose.',
+    id='api.E001',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """A deployment runs several processes, they need one cache"""
+    if settings.SHARED_CACHE:
+        return []
+    return [ERROR_LOCAL_CACHE]
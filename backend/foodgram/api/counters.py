@@ -0,0 +1,51 @@
+"""
+Counters kept in columns instead of COUNT in the read path. Signals change
+them with F-expressions together with the rows they count,
+`recompute_counters` fixes the drift left by changes bypassing signals.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Recipe, Subscription
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', User.favorite_recipes.through, 'recipe'),
+    (Recipe, 'in_carts_count', User.shopping_cart_recipes.through, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+def change_counter(queryset, field, delta):
+    """Add `delta` to the counter, which never goes below zero"""
+    if delta:
+        queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def count_related(model, field):
+    return Coalesce(
+        Subquery(model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')),
+        0,
+    )
+
+
+def recompute_counters(fix=True):
+    """Yield counters with number of rows they have drifted in"""
+    for model, field, related_model, related_field in COUNTERS:
+        actual = count_related(related_model, related_field)
+        drifted = model.objects.annotate(actual=actual).exclude(
+            **{field: F('actual')}
+        )
+        total = drifted.count()
+        if fix and total:
+            model.objects.filter(
+                pk__in=drifted.values('pk')
+            ).update(**{field: actual})
+        yield model, field, total
@@ -1,26 +1,197 @@
 import base64
-import uuid
+import hashlib
+import posixpath
 
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
-IMAGE_FILE_NAME = '{user}_recipe_{unique_end}.{extention}'
+from .images import touch_image
+
+IMAGE_FILE_NAME = '{digest}.{extention}'
 VALIDATION_ERROR_BASE64 = 'Неверный формат изображения.'
+VALIDATION_ERROR_IMAGE_FORMAT = (
+    'Поддерживаются изображения JPEG, PNG, GIF и WebP.'
+)
+VALIDATION_ERROR_IMAGE_SIZE = (
+    'Размер изображения не должен превышать {size} МБ.'
+)
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+WEBP_SIGNATURE = (b'RIFF', b'WEBP')
+
+
+def get_image_format(header):
+    """Format of an image by its first bytes, None for unknown ones"""
+    for signature, format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return format
+    if header[:4] == WEBP_SIGNATURE[0] and header[8:12] == WEBP_SIGNATURE[1]:
+        return 'webp'
+    return None
+
+
+def get_digest(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_image_size_error():
+    return VALIDATION_ERROR_IMAGE_SIZE.format(
+        size=settings.RECIPE_IMAGE_MAX_SIZE // (1024 * 1024)
+    )
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded files to a temporary file, checking the image format
+    by the first chunk and the size on every chunk, hashing the content
+    on the way. Writing stops at the first error, which is left in
+    `upload_error` of the file for the field
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.image_format = None
+        self.upload_error = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.upload_error:
+            return None
+        self.size += len(raw_data)
+        if self.size > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.upload_error = get_image_size_error()
+            return None
+        if start == 0:
+            self.image_format = get_image_format(raw_data)
+            if self.image_format is None:
+                self.upload_error = VALIDATION_ERROR_IMAGE_FORMAT
+                return None
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.digest = self.digest.hexdigest()
+        file.image_format = self.image_format
+        file.upload_error = self.upload_error
+        return file
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Image sent as a base64 data URL in JSON or as a file in a form.
+    Images are named by the hash of their content, so an image already
+    in the storage is reused as it is, without decoding and writing it
+    """
+    def __init__(self, *args, upload_to='', **kwargs):
+        self.upload_to = upload_to
+        super().__init__(*args, **kwargs)
+
+    def get_file_name(self, digest, extention):
+        return IMAGE_FILE_NAME.format(digest=digest, extention=extention)
+
+    def get_stored_name(self, file_name):
+        """Name of the same image in the storage, None if it is not there"""
+        name = posixpath.join(self.upload_to, file_name)
+        current = getattr(getattr(self.parent, 'instance', None),
+                          self.source, None)
+        if current and current.name == name:
+            return name
+        if not default_storage.exists(name):
+            return None
+        touch_image(name)
+        return name
+
     def to_internal_value(self, data):
         """Parse input string, decode, save image."""
+        if isinstance(data, UploadedFile):
+            if getattr(data, 'upload_error', None):
+                raise serializers.ValidationError(data.upload_error)
+            file_name = self.get_file_name(
+                getattr(data, 'digest', None) or get_digest(data.chunks()),
+                (getattr(data, 'image_format', None)
+                 or data.name.rsplit('.', 1)[-1]),
+            )
+            stored_name = self.get_stored_name(file_name)
+            if stored_name:
+                return stored_name
+            data.name = file_name
+            return super().to_internal_value(data)
         try:
             format, image_string = data.split(';base64,')
-            data = ContentFile(
-                base64.b64decode(image_string),
-                name=IMAGE_FILE_NAME.format(
-                    user=self.context['request'].user.username,
-                    unique_end=uuid.uuid4().hex[:12],
-                    extention=format.split('/')[-1]
-                )
-            )
-        except ValueError:
+            if len(image_string) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+                raise serializers.ValidationError(get_image_size_error())
+            content = base64.b64decode(image_string)
+        except (AttributeError, ValueError):
             raise serializers.ValidationError(VALIDATION_ERROR_BASE64)
+        file_name = self.get_file_name(
+            get_digest((content,)),
+            get_image_format(content) or format.split('/')[-1],
+        )
+        return self.get_stored_name(file_name) or super().to_internal_value(
+            ContentFile(content, name=file_name)
+        )
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field which can look up all keys of a list in one query.
+    Keys missing in preloaded objects are looked up one by one as usual
+    """
+    preloaded = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def preload(self, keys):
+        keys = {key for key in keys
+                if isinstance(key, (int, str)) and not isinstance(key, bool)}
+        try:
+            objects = self.get_queryset().in_bulk(keys)
+        except (TypeError, ValueError):
+            return
+        self.preloaded = {str(key): obj for key, obj in objects.items()}
+
+    def to_internal_value(self, data):
+        if self.preloaded is not None and not isinstance(data, bool):
+            obj = self.preloaded.get(str(data))
+            if obj is not None:
+                return obj
         return super().to_internal_value(data)
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child_relation.preload(data)
+        return super().to_internal_value(data)
+
+
+class RenditionsField(serializers.ReadOnlyField):
+    """URLs of resized copies of an image by sizes and formats"""
+    def to_representation(self, value):
+        request = self.context.get('request')
+        build_url = (request.build_absolute_uri if request is not None
+                     else str)
+        return {
+            size: {extension: build_url(default_storage.url(name))
+                   for extension, name in names.items()}
+            for size, names in value.items()
+        }
@@ -2,11 +2,11 @@ import django_filters as filters
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import FilterSet
 
-from .models import Tag
+from .models import Recipe, Tag
 
-BOOLEAN_TO_RANGE = {
-    False: 'exact',
-    True: 'gt',
+USER_RECIPE_RELATIONS = {
+    'is_favorited': 'favorite_recipes',
+    'is_in_shopping_cart': 'shopping_cart_recipes',
 }
 
 User = get_user_model()
@@ -17,16 +17,36 @@ class IngredientFilter(FilterSet):
 
 
 class RecipeFilter(FilterSet):
-    is_favorited = filters.BooleanFilter(method='filter_bool_to_range')
-    is_in_shopping_cart = filters.BooleanFilter(method='filter_bool_to_range')
+    is_favorited = filters.BooleanFilter(method='filter_user_relation')
+    is_in_shopping_cart = filters.BooleanFilter(method='filter_user_relation')
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
 
-    def filter_bool_to_range(self, queryset, name, value):
-        """Select number fieeld differently for `false` and for 'true'"""
-        lookup = '__'.join([name, BOOLEAN_TO_RANGE[value]])
-        return queryset.filter(**{lookup: 0})
+    def filter_tags(self, queryset, name, value):
+        """
+        Select recipes having any of the tags by a semi-join with recipe ids
+        of the tags, which needs no DISTINCT over the annotated recipes
+        """
+        if not value:
+            return queryset
+        return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+            tag__in=value
+        ).values('recipe_id'))
+
+    def filter_user_relation(self, queryset, name, value):
+        """
+        Select recipes in user's favorites or shopping cart starting from
+        the user's own relation table, the rest by the annotated flag
+        """
+        if not value or not self.request.user.is_authenticated:
+            return queryset.filter(**{name: value})
+        return queryset.filter(id__in=getattr(
+            User, USER_RECIPE_RELATIONS[name]
+        ).through.objects.filter(
+            user=self.request.user
+        ).values('recipe_id'))
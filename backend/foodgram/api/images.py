@@ -0,0 +1,196 @@
+"""
+Resized copies of recipe images. Pillow work runs in a pool of processes
+after the recipe is committed, so requests do not wait for it. Copies are
+saved without EXIF and listed in `Recipe.renditions` when they are ready.
+Images are named by their content, so recipes may share an image and its
+copies, and files no recipe refers to are removed by `find_orphans`.
+"""
+import logging
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .caches import RECIPES_VERSION, bump_recipe_version, bump_version
+from .models import Recipe
+
+RENDITION_SIZES = {
+    'card': (480, 480),
+    'detail': (960, 960),
+    'retina': (1920, 1920),
+}
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+RENDITION_NAME = '{directory}/renditions/{name}_{size}.{extension}'
+
+logger = logging.getLogger(__name__)
+
+
+def get_rendition_names(image_name):
+    """Names of all the copies of the image, by sizes and extensions"""
+    directory, name = os.path.split(image_name)
+    name = os.path.splitext(name)[0]
+    return {
+        size: {
+            extension: RENDITION_NAME.format(directory=directory or '.',
+                                             name=name,
+                                             size=size,
+                                             extension=extension)
+            for extension in RENDITION_FORMATS
+        }
+        for size in RENDITION_SIZES
+    }
+
+
+def iter_rendition_names(image_name):
+    for files in get_rendition_names(image_name).values():
+        yield from files.values()
+
+
+def renditions_outdated(recipe):
+    return bool(recipe.image) and (
+        recipe.renditions != get_rendition_names(recipe.image.name)
+    )
+
+
+def make_renditions(content):
+    """
+    Resize image bytes to every size and format, return bytes of copies.
+    Runs in worker processes, so it works with plain bytes only
+    """
+    with Image.open(BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        renditions = {}
+        for size, box in RENDITION_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail(box)
+            renditions[size] = {}
+            for extension, (format, options) in RENDITION_FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, format, **options)
+                renditions[size][extension] = buffer.getvalue()
+    return renditions
+
+
+def list_renditions(recipe_id, image_name):
+    """List copies in the recipe if its image is still the same"""
+    if Recipe.objects.filter(id=recipe_id, image=image_name).update(
+        renditions=get_rendition_names(image_name)
+    ):
+        bump_recipe_version(recipe_id)
+        bump_version(RECIPES_VERSION)
+
+
+def save_renditions(recipe_id, image_name, renditions):
+    """Store copies and list them in the recipe if its image is the same"""
+    names = get_rendition_names(image_name)
+    for size, files in renditions.items():
+        for extension, content in files.items():
+            default_storage.delete(names[size][extension])
+            default_storage.save(names[size][extension], ContentFile(content))
+    list_renditions(recipe_id, image_name)
+
+
+def renditions_stored(image_name):
+    """Whether copies of the image were made for another recipe already"""
+    return all(default_storage.exists(name)
+               for name in iter_rendition_names(image_name))
+
+
+def read_image(image_name):
+    with default_storage.open(image_name, 'rb') as file:
+        return file.read()
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ProcessPoolExecutor(max_workers=settings.IMAGE_RENDITION_WORKERS)
+
+
+def renditions_done(recipe_id, image_name, future):
+    try:
+        save_renditions(recipe_id, image_name, future.result())
+    except Exception:
+        logger.exception('Renditions of %s failed', image_name)
+    finally:
+        # Callbacks run in a thread of the pool, not in a request
+        connection.close()
+
+
+def submit_renditions(recipe_id, image_name):
+    """Make copies in the pool, or right away if there are no workers"""
+    try:
+        if renditions_stored(image_name):
+            list_renditions(recipe_id, image_name)
+            return
+        content = read_image(image_name)
+        if not settings.IMAGE_RENDITION_WORKERS:
+            save_renditions(recipe_id, image_name, make_renditions(content))
+            return
+        get_executor().submit(make_renditions, content).add_done_callback(
+            partial(renditions_done, recipe_id, image_name)
+        )
+    except Exception:
+        logger.exception('Renditions of %s failed', image_name)
+
+
+def schedule_renditions(recipe):
+    """Make copies of the recipe image once the transaction commits"""
+    transaction.on_commit(
+        partial(submit_renditions, recipe.id, recipe.image.name)
+    )
+
+
+def touch_image(name):
+    """
+    Renew modification time of a reused image, so the image is not taken
+    for an orphan before the recipe reusing it is committed
+    """
+    try:
+        os.utime(default_storage.path(name))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def walk_storage(directory):
+    directories, files = default_storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for subdirectory in directories:
+        yield from walk_storage(posixpath.join(directory, subdirectory))
+
+
+def find_orphans(min_age):
+    """
+    Names of image files no recipe refers to, modified more than `min_age`
+    ago. Copies are orphans only when their image is gone or is an orphan
+    """
+    referenced = set()
+    for image, renditions in Recipe.objects.values_list(
+        'image', 'renditions'
+    ).iterator():
+        referenced.add(image)
+        referenced.update(name for files in renditions.values()
+                          for name in files.values())
+    directory = Recipe._meta.get_field('image').upload_to
+    if not default_storage.exists(directory):
+        return []
+    border = timezone.now() - min_age
+    names = set(walk_storage(directory))
+    orphans = {name for name in names - referenced
+               if default_storage.get_modified_time(name) < border}
+    for name in names - orphans:
+        referenced.update(iter_rendition_names(name))
+    return sorted(name for name in orphans if name not in referenced)
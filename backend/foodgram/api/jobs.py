@@ -0,0 +1,81 @@
+"""
+Database backed queue of shopping list PDF renders.
+Views enqueue jobs, `python manage.py run_shop_list_worker` renders them.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ShopListJob
+from .utils import get_shop_list_pdf
+
+JOB_STALE_AFTER = timedelta(minutes=5)
+JOB_KEEP_FOR = timedelta(days=1)
+JOB_CLAIM_CANDIDATES = 10
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_shop_list(user):
+    return ShopListJob.objects.create(user=user)
+
+
+def claim_job():
+    """
+    Take the oldest pending job or a job left running by a dead worker.
+    Conditional UPDATE makes a claim atomic without row locks, so several
+    workers may share a queue on any database backend.
+    """
+    now = timezone.now()
+    claimable = (Q(status=ShopListJob.Status.PENDING)
+                 | Q(status=ShopListJob.Status.RUNNING,
+                     started__lt=now - JOB_STALE_AFTER))
+    for job in ShopListJob.objects.filter(claimable).only(
+        'id', 'status', 'started'
+    )[:JOB_CLAIM_CANDIDATES]:
+        if ShopListJob.objects.filter(
+            id=job.id, status=job.status, started=job.started
+        ).update(status=ShopListJob.Status.RUNNING, started=now):
+            return ShopListJob.objects.select_related('user').defer(
+                'result'
+            ).get(id=job.id)
+    return None
+
+
+def run_job(job):
+    """
+    Render the shopping list of a claimed job. The worker is a separate
+    process: without a shared cache its versions never see the bumps made
+    by web processes, so the list is rendered from the database
+    """
+    try:
+        job.result = get_shop_list_pdf(job.user, cached=settings.SHARED_CACHE)
+        job.status = ShopListJob.Status.DONE
+    except Exception:
+        logger.exception('Shopping list job %s failed', job.id)
+        job.status = ShopListJob.Status.FAILED
+    job.finished = timezone.now()
+    job.save(update_fields=('result', 'status', 'finished'))
+    return job
+
+
+def run_pending_jobs(limit=None):
+    """Run jobs until the queue is empty or limit is reached"""
+    done = 0
+    while limit is None or done < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        done += 1
+    return done
+
+
+def delete_expired_jobs():
+    return ShopListJob.objects.filter(
+        status__in=(ShopListJob.Status.DONE, ShopListJob.Status.FAILED),
+        finished__lt=timezone.now() - JOB_KEEP_FOR,
+    ).delete()[0]
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import BENCHMARKS
+
+MESSAGE_UNKNOWN = 'Unknown benchmark: {name}. Available: {available}'
+MESSAGE_RESULT = '{name} | {label} | {metrics}'
+
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks of hot paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Benchmarks to run, all by default')
+
+    def handle(self, *args, **options):
+        names = options['names'] or BENCHMARKS.keys()
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError(MESSAGE_UNKNOWN.format(
+                    name=name,
+                    available=', '.join(BENCHMARKS),
+                ))
+        for name in names:
+            for label, metrics in BENCHMARKS[name]():
+                self.stdout.write(MESSAGE_RESULT.format(
+                    name=name,
+                    label=label,
+                    metrics=', '.join(f'{key}={value}'
+                                      for key, value in metrics.items()),
+                ))
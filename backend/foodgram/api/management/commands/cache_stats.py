@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.caches import STATS_NAMES, get_stats
+
+MESSAGE_STATS = '{name}: hits={hits}, misses={misses}, hit rate={hit_rate}'
+
+
+class Command(BaseCommand):
+    help = 'Shows hit and miss counters of application caches'
+
+    def handle(self, *args, **options):
+        for name in STATS_NAMES:
+            self.stdout.write(MESSAGE_STATS.format(name=name,
+                                                   **get_stats(name)))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.transfer import EXPORT_CHUNK_SIZE, export_recipes
+
+
+class Command(BaseCommand):
+    help = 'Exports recipes to NDJSON, one recipe per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File to write, stdout '
+                                             'by default')
+        parser.add_argument('--no-images', action='store_true',
+                            help='Keep image names only, without files')
+        parser.add_argument('--chunk-size', type=int,
+                            default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        output = (open(options['output'], 'w', encoding='utf8')
+                  if options['output'] else None)
+        try:
+            for line in export_recipes(images=not options['no_images'],
+                                       chunk_size=options['chunk_size']):
+                if output:
+                    output.write(line + '\n')
+                else:
+                    self.stdout.write(line)
+        finally:
+            if output:
+                output.close()
@@ -1,52 +1,172 @@
 import csv
+import time
+from itertools import islice
 
-import django.db.utils
-from django.core.management.base import BaseCommand
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from tqdm import tqdm
 
-from api.models import Ingredient
+from api.caches import INGREDIENTS_VERSION, TAGS_VERSION, bump_version
+from api.models import Ingredient, Tag
 
 MESSAGE_START = 'Please wait until Finished! prompt'
 MESSAGE_ERROR_CREATE = (
     'Unable to create {model} from {file} with values: {values}'
 )
-MESSAGE_SUCCESS_CREATE = 'Successfully created {total} {model} from {file}'
+MESSAGE_SUCCESS_CREATE = (
+    'Successfully created {created} of {total} {model} from {file} '
+    'in {seconds:.2f}s ({speed:.0f} rows/sec)'
+)
+MESSAGE_DRY_RUN = 'Dry run, nothing was saved'
 MESSAGE_FINISH = 'Finished!'
+MESSAGE_NO_FIELDS = 'Fields of {model} are required to import {file}'
+MESSAGE_UNKNOWN_MODEL = 'Unknown model: {model}'
 
+DEFAULT_BATCH_SIZE = 5000
 DATA = (
     ('../data/ingredients.csv', ('name', 'measurement_unit'), Ingredient),
 )
+# bulk_create sends no signals, so versions of cached data are bumped here
+MODEL_VERSIONS = {
+    Ingredient: INGREDIENTS_VERSION,
+    Tag: TAGS_VERSION,
+}
+
+
+def insert_ignore(model, fields, rows):
+    """
+    Insert rows of raw values in one statement, rows conflicting with
+    existing ones are skipped. Fields missing in rows get their defaults
+    """
+    fields = list(fields)
+    defaults = [
+        field for field in model._meta.concrete_fields
+        if field not in fields and not field.primary_key
+        and field.has_default()
+    ]
+    default_values = [field.get_db_prep_save(field.get_default(), connection)
+                      for field in defaults]
+    params = []
+    for row in rows:
+        params.extend(
+            field.get_db_prep_save(field.to_python(value), connection)
+            for field, value in zip(fields, row)
+        )
+        params.extend(default_values)
+    fields += defaults
+    ops = connection.ops
+    sql = '{insert} {table} ({columns}) {values} {suffix}'.format(
+        insert=ops.insert_statement(ignore_conflicts=True),
+        table=ops.quote_name(model._meta.db_table),
+        columns=', '.join(ops.quote_name(field.column) for field in fields),
+        values=ops.bulk_insert_sql(fields,
+                                   [['%s'] * len(fields)] * len(rows)),
+        suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
 
 
 class Command(BaseCommand):
-    help = 'Imports data from csv files to database'
+    help = (
+        'Imports data from csv files to database. '
+        'Rows already present are skipped, so the import can be rerun'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*',
+                            help='Csv files, the ingredients catalog '
+                                 'by default')
+        parser.add_argument('--model', default='api.Ingredient',
+                            help='Model to create, app_label.ModelName')
+        parser.add_argument('--fields',
+                            help='Comma separated fields of csv columns')
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Import in a transaction rolled back '
+                                 'at the end')
+
+    def get_data(self, options):
+        if not options['files']:
+            return DATA
+        try:
+            Model = apps.get_model(options['model'])
+        except (LookupError, ValueError):
+            raise CommandError(
+                MESSAGE_UNKNOWN_MODEL.format(model=options['model'])
+            )
+        fieldnames = options['fields'] and options['fields'].split(',')
+        if not fieldnames:
+            fieldnames = next((fieldnames for _, fieldnames, model in DATA
+                               if model is Model), None)
+        if not fieldnames:
+            raise CommandError(MESSAGE_NO_FIELDS.format(
+                model=Model.__name__,
+                file=', '.join(options['files']),
+            ))
+        return [(file, fieldnames, Model) for file in options['files']]
+
+    def read_rows(self, file, fieldnames, model):
+        with open(file, encoding='utf8', newline='') as csvfile:
+            for row in csv.reader(csvfile):
+                if len(row) != len(fieldnames):
+                    self.stdout.write(self.style.ERROR(
+                        MESSAGE_ERROR_CREATE.format(
+                            model=model.__name__,
+                            file=file,
+                            values=(*row,),
+                        )
+                    ))
+                    self.errors += 1
+                    continue
+                yield row
+
+    def import_file(self, file, fieldnames, model, batch_size):
+        """Stream csv rows into the table by batches, return row counts"""
+        fields = [model._meta.get_field(name) for name in fieldnames]
+        batch_size = min(batch_size, connection.ops.bulk_batch_size(
+            fields, range(batch_size)
+        ))
+        before = model.objects.count()
+        self.errors = 0
+        rows = self.read_rows(file, fieldnames, model)
+        total = 0
+        with tqdm(unit=' rows', disable=not self.verbosity) as progress:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                insert_ignore(model, fields, batch)
+                progress.update(len(batch))
+                total += len(batch)
+        return model.objects.count() - before, total + self.errors
 
     def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
         self.stdout.write(
             self.style.NOTICE(MESSAGE_START)
         )
-        for file, fieldnames, Model in DATA:
-            with open(file, encoding='utf8') as csvfile:
-                total = sum(1 for _ in csv.reader(csvfile))
-                csvfile.seek(0)
-                for row in tqdm(csv.DictReader(csvfile, fieldnames=fieldnames),
-                                total=total):
-                    try:
-                        Model.objects.create(**row)
-                    except django.db.utils.IntegrityError:
-                        self.stdout.write(self.style.ERROR(
-                            MESSAGE_ERROR_CREATE.format(
-                                model=Model.__name__,
-                                file=file,
-                                values=(*row.values(),)
-                            )
-                        ))
-                        total -= 1
-                self.stdout.write(self.style.SUCCESS(
-                    MESSAGE_SUCCESS_CREATE.format(
-                        total=total,
-                        model=Model.__name__,
-                        file=file,
-                    )
-                ))
+        for file, fieldnames, Model in self.get_data(options):
+            start = time.perf_counter()
+            with transaction.atomic():
+                created, total = self.import_file(file, fieldnames, Model,
+                                                  options['batch_size'])
+                transaction.set_rollback(options['dry_run'])
+            seconds = time.perf_counter() - start
+            if created and not options['dry_run'] and Model in MODEL_VERSIONS:
+                bump_version(MODEL_VERSIONS[Model])
+            self.stdout.write(self.style.SUCCESS(
+                MESSAGE_SUCCESS_CREATE.format(
+                    created=created,
+                    total=total,
+                    model=Model.__name__,
+                    file=file,
+                    seconds=seconds,
+                    speed=total / seconds if seconds else total,
+                )
+            ))
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(MESSAGE_DRY_RUN))
         self.stdout.write(self.style.SUCCESS(MESSAGE_FINISH))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from api.transfer import IMPORT_BATCH_SIZE, import_recipes
+
+MESSAGE_CHUNK = 'Created {created}, skipped {skipped}'
+MESSAGE_FINISH = 'Finished! Created {created}, skipped {skipped} recipes'
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports recipes from NDJSON made by export_recipes. '
+        'Recipes with images already present are skipped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--batch-size', type=int,
+                            default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total_created = total_skipped = 0
+        with open(options['file'], encoding='utf8') as lines:
+            for created, skipped in import_recipes(
+                lines, batch_size=options['batch_size']
+            ):
+                total_created += created
+                total_skipped += skipped
+                if options['verbosity'] > 1:
+                    self.stdout.write(MESSAGE_CHUNK.format(
+                        created=created,
+                        skipped=skipped,
+                    ))
+        self.stdout.write(self.style.SUCCESS(MESSAGE_FINISH.format(
+            created=total_created,
+            skipped=total_skipped,
+        )))
@@ -0,0 +1,80 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import (
+    make_renditions, read_image, renditions_outdated, save_renditions,
+)
+from api.models import Recipe
+
+DEFAULT_BATCH_SIZE = 20
+MESSAGE_ERROR = 'Unable to read {image} of recipe {recipe}: {error}'
+MESSAGE_ERROR_RENDER = 'Unable to resize {image} of recipe {recipe}: {error}'
+MESSAGE_FINISH = 'Finished! Made renditions of {total} images'
+
+
+class Command(BaseCommand):
+    help = 'Makes resized copies of recipe images lacking up to date ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Remake copies of every image')
+        parser.add_argument('--workers', type=int,
+                            default=settings.IMAGE_RENDITION_WORKERS,
+                            help='Processes resizing images, 0 resizes '
+                                 'them in this one')
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE)
+
+    def read_images(self, recipes):
+        for recipe in recipes:
+            try:
+                yield recipe, read_image(recipe.image.name)
+            except OSError as error:
+                self.stderr.write(MESSAGE_ERROR.format(
+                    image=recipe.image.name,
+                    recipe=recipe.id,
+                    error=error,
+                ))
+
+    def handle(self, *args, **options):
+        recipes = (
+            recipe for recipe in Recipe.objects.only(
+                'id', 'image', 'renditions'
+            ).order_by('id').iterator()
+            if recipe.image and (options['all']
+                                 or renditions_outdated(recipe))
+        )
+        images = self.read_images(recipes)
+        pool = (ProcessPoolExecutor(max_workers=options['workers'])
+                if options['workers'] else None)
+        total = 0
+        try:
+            while True:
+                batch = list(islice(images, options['batch_size']))
+                if not batch:
+                    break
+                if pool:
+                    batch = [(recipe, pool.submit(make_renditions, content))
+                             for recipe, content in batch]
+                for recipe, content in batch:
+                    try:
+                        renditions = (content.result() if pool
+                                      else make_renditions(content))
+                    except Exception as error:
+                        self.stderr.write(MESSAGE_ERROR_RENDER.format(
+                            image=recipe.image.name,
+                            recipe=recipe.id,
+                            error=error,
+                        ))
+                        continue
+                    save_renditions(recipe.id, recipe.image.name, renditions)
+                    total += 1
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            MESSAGE_FINISH.format(total=total)
+        ))
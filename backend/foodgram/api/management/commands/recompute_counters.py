@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import recompute_counters
+
+MESSAGE_DRIFT = '{model}.{field}: {total} rows drifted'
+MESSAGE_FIXED = 'Fixed'
+MESSAGE_CHECKED = 'Checked only, run without --check to fix'
+
+
+class Command(BaseCommand):
+    help = 'Recomputes counter columns and reports their drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Report the drift without fixing it')
+
+    def handle(self, *args, **options):
+        for model, field, total in recompute_counters(
+            fix=not options['check']
+        ):
+            self.stdout.write(MESSAGE_DRIFT.format(
+                model=model.__name__,
+                field=field,
+                total=total,
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            MESSAGE_CHECKED if options['check'] else MESSAGE_FIXED
+        ))
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.images import find_orphans
+
+DEFAULT_MIN_AGE = 60
+MESSAGE_REMOVE = 'Removing {name}'
+MESSAGE_DRY_RUN = 'Dry run, nothing was removed'
+MESSAGE_FINISH = 'Finished! Removed {total} files, {size:.1f} MB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes recipe images and their resized copies no recipe refers '
+        'to. Images are shared by recipes with the same picture, so they '
+        'are not removed along with recipes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=DEFAULT_MIN_AGE,
+                            help='Minutes since the last change of files '
+                                 'to remove, younger files may belong to '
+                                 'recipes being saved')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List orphans without removing them')
+
+    def handle(self, *args, **options):
+        total = size = 0
+        for name in find_orphans(timedelta(minutes=options['min_age'])):
+            if options['verbosity'] > 1:
+                self.stdout.write(MESSAGE_REMOVE.format(name=name))
+            size += default_storage.size(name)
+            if not options['dry_run']:
+                default_storage.delete(name)
+            total += 1
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(MESSAGE_DRY_RUN))
+        self.stdout.write(self.style.SUCCESS(MESSAGE_FINISH.format(
+            total=total,
+            size=size / (1024 * 1024),
+        )))
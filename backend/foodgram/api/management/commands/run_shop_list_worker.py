@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import delete_expired_jobs, run_pending_jobs
+
+MESSAGE_START = 'Shopping list worker started'
+MESSAGE_DONE = 'Rendered {total} shopping lists'
+MESSAGE_EXPIRED = 'Deleted {total} expired shopping list jobs'
+
+
+class Command(BaseCommand):
+    help = 'Renders queued shopping list PDFs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Empty the queue once and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds between polls of an empty queue')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.NOTICE(MESSAGE_START))
+        while True:
+            total = run_pending_jobs()
+            if total:
+                self.stdout.write(MESSAGE_DONE.format(total=total))
+            expired = delete_expired_jobs()
+            if expired:
+                self.stdout.write(MESSAGE_EXPIRED.format(total=expired))
+            if options['once']:
+                return
+            if not total:
+                time.sleep(options['interval'])
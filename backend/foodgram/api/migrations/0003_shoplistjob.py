@@ -0,0 +1,36 @@
+# Generated by Django 3.2.7 on 2026-10-18 04:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_subscription_unique_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopListJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('result', models.BinaryField(blank=True, null=True, verbose_name='Список покупок в PDF')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки в очередь')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Дата начала выполнения')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Дата окончания выполнения')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_list_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задача на список покупок',
+                'verbose_name_plural': 'Задачи на список покупок',
+                'ordering': ('created',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='shoplistjob',
+            index=models.Index(fields=['status', 'created'], name='shop_list_job_queue'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.7 on 2026-10-18 05:06
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Keep the first of equal ingredients, move recipes to it. A recipe
+    using several of them keeps one row with the amounts added up
+    """
+    Ingredient = apps.get_model('api', 'Ingredient')
+    IngredientInRecipe = apps.get_model('api', 'IngredientInRecipe')
+    db = schema_editor.connection.alias
+    duplicates = Ingredient.objects.using(db).values(
+        'name', 'measurement_unit'
+    ).order_by().annotate(first=Min('id'), total=Count('id')).filter(
+        total__gt=1
+    )
+    for duplicate in duplicates:
+        others = Ingredient.objects.using(db).filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=duplicate['first'])
+        rows = IngredientInRecipe.objects.using(db).filter(
+            ingredient__name=duplicate['name'],
+            ingredient__measurement_unit=duplicate['measurement_unit'],
+        )
+        repeated = rows.values('recipe').order_by().annotate(
+            kept=Min('id'), total_amount=Sum('amount'), total=Count('id'),
+        ).filter(total__gt=1)
+        for row in repeated:
+            rows.filter(recipe=row['recipe']).exclude(id=row['kept']).delete()
+            IngredientInRecipe.objects.using(db).filter(
+                id=row['kept']
+            ).update(amount=row['total_amount'])
+        IngredientInRecipe.objects.using(db).filter(
+            ingredient__in=others
+        ).update(ingredient=duplicate['first'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
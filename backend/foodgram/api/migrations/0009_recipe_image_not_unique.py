@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_recipe_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(upload_to='recipes', verbose_name='Ссылка на картинку на сайте'),
+        ),
+    ]
@@ -0,0 +1,319 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .caches import (
+    FLAGS_VERSION, INGREDIENTS_VERSION, RECIPE_FRAGMENT_STATS, RECIPE_VERSION,
+    RESPONSE_STATS, TAGS_VERSION, USER_VERSION, get_validators, get_versions,
+    record,
+)
+from .models import Subscription
+from .replicas import (
+    get_read_database, pin_to_primary, read_database, read_primary_if_modified,
+)
+
+RESPONSE_CACHE_KEY = 'response:{url}:{query}:{versions}'
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+RECIPE_FRAGMENT_KEY = 'recipe_fragment:{host}:{recipe}:{versions}'
+RECIPE_FRAGMENT_TIMEOUT = 24 * 60 * 60
+ETAG = '"{digest}"'
+SNAPSHOT_KEY = 'snapshot:{name}:{version}'
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+SNAPSHOT_ETAG = '"{name}-{version}"'
+SNAPSHOT_CACHE_CONTROL = 'public, max-age=3600'
+
+_snapshots = {}
+
+
+def normalize_query(request):
+    """Query string with parameters sorted, the same for any their order"""
+    return urlencode(sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    ))
+
+
+class ReplicaReadMixin:
+    """
+    Read safe requests from a replica unless the user is pinned to the
+    primary, successful writes pin the user. `primary_actions` are actions
+    of safe methods which write or poll background jobs, they are handled
+    as writes. The database is chosen after authentication and restored
+    when the request is done.
+    """
+    primary_actions = ()
+
+    def is_write(self, request):
+        return (request.method not in SAFE_METHODS
+                or self.action in self.primary_actions)
+
+    def dispatch(self, request, *args, **kwargs):
+        token = read_database.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            read_database.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not self.is_write(request):
+            read_database.set(get_read_database(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            self.is_write(request)
+            and status.is_success(response.status_code)
+            and request.user.is_authenticated
+        ):
+            pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReferenceSnapshotMixin:
+    """
+    Serve the full list of reference data as JSON rendered once per version
+    of `snapshot_version`. The rendered bytes are kept in the process and
+    in the shared cache, the version is the ETag of the response.
+    """
+    snapshot_version = None
+    snapshot_renderer_class = JSONRenderer
+
+    def list(self, request, *args, **kwargs):
+        if (
+            request.query_params
+            or request.accepted_renderer.format
+            != self.snapshot_renderer_class.format
+        ):
+            return super().list(request, *args, **kwargs)
+        (version,), last_modified = get_validators(self.snapshot_version)
+        read_primary_if_modified(last_modified)
+        last_modified = int(last_modified)
+        etag = SNAPSHOT_ETAG.format(name=self.snapshot_version,
+                                    version=version)
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(
+                self.get_snapshot(version),
+                content_type=self.snapshot_renderer_class.media_type,
+            )
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = SNAPSHOT_CACHE_CONTROL
+        return response
+
+    def get_snapshot(self, version):
+        name = self.snapshot_version
+        snapshot = _snapshots.get(name)
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1]
+        key = SNAPSHOT_KEY.format(name=name, version=version)
+        content = cache.get(key)
+        if content is None:
+            content = self.snapshot_renderer_class().render(
+                self.get_serializer(self.get_queryset(), many=True).data
+            )
+            cache.set(key, content, SNAPSHOT_TIMEOUT)
+        _snapshots[name] = (version, content)
+        return content
+
+
+class ConditionalResponseMixin:
+    """
+    Add ETag and Last-Modified to list and retrieve responses. They are
+    built from versions of the data the response depends on, so matching
+    conditional requests get 304 before any serialization happens.
+    """
+    conditional_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request,
+                                             *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request,
+                                             *args, **kwargs)
+
+    def get_conditional_versions(self):
+        """Names of versions, flags of the user for user dependent data"""
+        if FLAGS_VERSION in self.conditional_versions:
+            return [FLAGS_VERSION.format(user=self.request.user.pk)
+                    if name == FLAGS_VERSION else name
+                    for name in self.conditional_versions]
+        return self.conditional_versions
+
+    def get_validators(self):
+        """Values identifying the response and time it was last modified"""
+        versions, last_modified = get_validators(
+            *self.get_conditional_versions()
+        )
+        read_primary_if_modified(last_modified)
+        return versions, last_modified
+
+    def get_conditional_response(self, action, request, *args, **kwargs):
+        versions, last_modified = self.get_validators()
+        etag = ETAG.format(digest=hashlib.sha1(':'.join(str(part) for part in (
+            request.build_absolute_uri(request.path),
+            normalize_query(request),
+            request.accepted_renderer.format,
+            request.user.pk,
+            *versions,
+        )).encode()).hexdigest())
+        last_modified = int(last_modified)
+        response = get_conditional_response(request,
+                                            etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = action(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Cache data of list and retrieve responses for anonymous users.
+    Keys include versions of `response_cache_versions`, so responses are
+    invalidated by signals changing the data they are built from.
+    """
+    response_cache_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request,
+                                        *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request,
+                                        *args, **kwargs)
+
+    def get_response_cache_key(self, request):
+        return RESPONSE_CACHE_KEY.format(
+            url=request.build_absolute_uri(request.path),
+            query=hashlib.md5(normalize_query(request).encode()).hexdigest(),
+            versions='.'.join(
+                str(version)
+                for version in get_versions(*self.response_cache_versions)
+            ),
+        )
+
+    def get_cached_response(self, action, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return action(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        record(RESPONSE_STATS, hit=data is not None)
+        if data is not None:
+            return Response(data)
+        response = action(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, RESPONSE_CACHE_TIMEOUT)
+        return response
+
+
+class RecipeFragmentCacheMixin:
+    """
+    Cache serialized recipes of list and retrieve responses for users with
+    accounts. The cached fragments are the same for every user, the flags
+    depending on the user are put over them at request time.
+    Views provide `get_prefetch_lookups` needed to serialize a recipe.
+    """
+    fragment_versions = (TAGS_VERSION, INGREDIENTS_VERSION)
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(
+            self.get_queryset().prefetch_related(None)
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_fragments(page))
+        return Response(self.get_fragments(list(queryset)))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        recipe = get_object_or_404(
+            self.get_queryset().prefetch_related(None),
+            **{self.lookup_field: kwargs[lookup_url_kwarg]},
+        )
+        self.check_object_permissions(request, recipe)
+        return Response(self.get_fragments([recipe])[0])
+
+    def get_fragment_keys(self, recipes):
+        """Key of a recipe depends on versions of the recipe and its author"""
+        names = [*self.fragment_versions]
+        for recipe in recipes:
+            names += (RECIPE_VERSION.format(recipe=recipe.pk),
+                      USER_VERSION.format(user=recipe.author_id))
+        versions = get_versions(*names)
+        common = versions[:len(self.fragment_versions)]
+        host = self.request.build_absolute_uri('/')
+        return [
+            RECIPE_FRAGMENT_KEY.format(
+                host=host,
+                recipe=recipe.pk,
+                versions='.'.join(str(version) for version in (
+                    *common, *versions[len(common) + 2 * number:
+                                       len(common) + 2 * number + 2]
+                )),
+            )
+            for number, recipe in enumerate(recipes)
+        ]
+
+    def get_fragments(self, recipes):
+        keys = self.get_fragment_keys(recipes)
+        fragments = cache.get_many(keys)
+        missing = {recipe.pk: key
+                   for recipe, key in zip(recipes, keys)
+                   if key not in fragments}
+        record(RECIPE_FRAGMENT_STATS, hit=True, count=len(fragments))
+        record(RECIPE_FRAGMENT_STATS, hit=False, count=len(missing))
+        if missing:
+            recipes_missing = [recipe for recipe in recipes
+                               if recipe.pk in missing]
+            prefetch_related_objects(recipes_missing,
+                                     *self.get_prefetch_lookups())
+            serialized = {
+                missing[recipe['id']]: recipe
+                for recipe in self.get_serializer(recipes_missing,
+                                                  many=True).data
+            }
+            cache.set_many(serialized, RECIPE_FRAGMENT_TIMEOUT)
+            fragments.update(serialized)
+        subscribed = {recipe.author_id for recipe in recipes
+                      if recipe.pk in missing and recipe.author.is_subscribed}
+        authors = {recipe.author_id for recipe in recipes
+                   if recipe.pk not in missing}
+        if authors - subscribed:
+            subscribed.update(Subscription.objects.filter(
+                subscriber=self.request.user,
+                author_id__in=authors - subscribed,
+            ).values_list('author_id', flat=True))
+        return [
+            {
+                **fragments[key],
+                'author': {
+                    **fragments[key]['author'],
+                    'is_subscribed': recipe.author_id in subscribed,
+                },
+                'is_favorited': recipe.is_favorited,
+                'is_in_shopping_cart': recipe.is_in_shopping_cart,
+            }
+            for recipe, key in zip(recipes, keys)
+        ]
@@ -42,6 +42,16 @@ class User(AbstractUser):
         related_name='users_have_in_favorite',
         verbose_name='Избранное',
     )
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0,
+        editable=False,
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'password', 'first_name', 'last_name']
 
@@ -134,6 +144,10 @@ class Ingredient(models.Model):
         ordering = (
             'name',
         )
+        constraints = (
+            models.UniqueConstraint(fields=('name', 'measurement_unit'),
+                                    name='unique_ingredient'),
+        )
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -153,7 +167,12 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Ссылка на картинку на сайте',
         upload_to='recipes',
-        unique=True
+    )
+    renditions = models.JSONField(
+        'Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     text = models.TextField(
         'Описание',
@@ -179,6 +198,20 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True,
     )
+    modified = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Число добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'Число добавлений в корзину',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
@@ -186,6 +219,10 @@ class Recipe(models.Model):
         ordering = (
             '-pub_date',
         )
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id'),
+        )
 
     def __str__(self):
         return f'{self.name}'
@@ -215,3 +252,57 @@ class IngredientInRecipe(models.Model):
         ordering = (
             'recipe',
         )
+
+
+class ShopListJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shop_list_jobs',
+        verbose_name='Пользователь',
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    result = models.BinaryField(
+        'Список покупок в PDF',
+        blank=True,
+        null=True,
+    )
+    created = models.DateTimeField(
+        'Дата постановки в очередь',
+        auto_now_add=True,
+    )
+    started = models.DateTimeField(
+        'Дата начала выполнения',
+        blank=True,
+        null=True,
+    )
+    finished = models.DateTimeField(
+        'Дата окончания выполнения',
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        verbose_name = 'Задача на список покупок'
+        verbose_name_plural = 'Задачи на список покупок'
+        ordering = (
+            'created',
+        )
+        indexes = (
+            models.Index(fields=('status', 'created'),
+                         name='shop_list_job_queue'),
+        )
+
+    def __str__(self):
+        return f'{self.user.username}: {self.status}'
@@ -0,0 +1,8 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class FormatParamContentNegotiation(DefaultContentNegotiation):
+    """Leave `format` query parameter to the view instead of renderers"""
+
+    def filter_renderers(self, renderers, format):
+        return renderers
@@ -1,7 +1,156 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination, PageNumberPagination, _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+ERROR_INVALID_CURSOR = 'Неверный курсор.'
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'limit'
     max_page_size = 1000
+
+
+class CursorLimitPagination(BasePagination):
+    """
+    Keyset pagination over the view's `cursor_ordering` fields.
+    The cursor keeps ordering values of the page edge, so every page is
+    a single indexed range query without COUNT and OFFSET.
+    """
+    cursor_query_param = 'cursor'
+    page_size = PageLimitPagination.page_size
+    page_size_query_param = PageLimitPagination.page_size_query_param
+    max_page_size = PageLimitPagination.max_page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = view.cursor_ordering
+        self.page_size = self.get_page_size(request)
+        position, self.reverse = self.decode_cursor(request, queryset.model)
+        ordering = (self.ordering if not self.reverse
+                    else [self.invert(field) for field in self.ordering])
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering,
+                                                              position))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def get_keyset_filter(ordering, position):
+        """Build `(a, b) > (x, y)` as `a > x OR (a = x AND b > y)`"""
+        condition = None
+        for index, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{field.lstrip("-")}__{lookup}': position[index]})
+            for previous, value in zip(ordering[:index], position):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition = step if condition is None else condition | step
+        return condition
+
+    def encode_cursor(self, instance, reverse):
+        cursor = base64.urlsafe_b64encode(json.dumps({
+            'p': [str(getattr(instance, field.lstrip('-')))
+                  for field in self.ordering],
+            'r': reverse,
+        }).encode()).decode()
+        return replace_query_param(
+            remove_query_param(self.request.build_absolute_uri(),
+                               self.cursor_query_param),
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def decode_cursor(self, request, model):
+        """Return edge ordering values converted to field types"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            position, reverse = data['p'], bool(data['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(ERROR_INVALID_CURSOR)
+        if not isinstance(position, list) or (
+            len(position) != len(self.ordering)
+        ):
+            raise NotFound(ERROR_INVALID_CURSOR)
+        try:
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(ERROR_INVALID_CURSOR)
+        return position, reverse
+
+
+class PageOrCursorPagination(PageLimitPagination):
+    """
+    Page number pagination switching to keyset one when the view
+    defines `cursor_ordering` and `cursor` query parameter is passed
+    """
+    cursor_class = CursorLimitPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if (
+            getattr(view, 'cursor_ordering', None)
+            and self.cursor_class.cursor_query_param in request.query_params
+        ):
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(queryset,
+                                                           request,
+                                                           view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
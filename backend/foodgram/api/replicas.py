@@ -0,0 +1,75 @@
+"""
+Reads of safe API requests go to replicas, everything else goes to the
+primary. A user who has just written is pinned to the primary for
+PRIMARY_PIN_TIMEOUT seconds, so replication lag does not hide their own
+changes from them. Data changed as recently is read from the primary by
+everyone, otherwise cached responses and ETags would keep its replica
+state after the versions were bumped. Pins and versions must be seen by
+every process, so without a shared cache everything is read from the
+primary. Requests choose the database in `ReplicaReadMixin`.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_KEY = 'primary:{user}'
+# Tokens, sessions and the database cache are read right after writes
+PRIMARY_APPS = {'authtoken', 'sessions', 'django_cache'}
+
+read_database = ContextVar('read_database', default=None)
+
+
+def pin_to_primary(user_id):
+    cache.set(PIN_KEY.format(user=user_id), True,
+              timeout=settings.PRIMARY_PIN_TIMEOUT)
+
+
+def get_read_database(user):
+    """Replica to read from, None for the primary"""
+    if not settings.REPLICA_DATABASES or not settings.SHARED_CACHE:
+        return None
+    if user.is_authenticated and cache.get(PIN_KEY.format(user=user.pk)):
+        return None
+    return random.choice(settings.REPLICA_DATABASES)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Read from the primary inside, for data rebuilt into caches keyed by
+    versions: a lagging replica would keep its rows under the new version
+    until the next bump
+    """
+    token = read_database.set(None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def read_primary_if_modified(last_modified):
+    """Read from the primary if versions were bumped within the lag"""
+    if (
+        read_database.get()
+        and time.time() - last_modified < settings.PRIMARY_PIN_TIMEOUT
+    ):
+        read_database.set(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return read_database.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same data as the primary"""
+        return True
@@ -0,0 +1,71 @@
+"""
+Process-local ingredient search index for the recipe editor autocomplete.
+The catalog is small and rarely changes, so it is kept in memory sorted by
+case-folded name and rebuilt when the ingredients version changes.
+"""
+import logging
+import threading
+from bisect import bisect_left
+from itertools import islice
+
+from django.db import DatabaseError
+
+from .caches import INGREDIENTS_VERSION, get_version
+from .models import Ingredient
+from .replicas import primary_reads
+
+INGREDIENT_SEARCH_LIMIT = 30
+PREFIX_END = chr(0x10FFFF)
+
+logger = logging.getLogger(__name__)
+
+
+class IngredientIndex:
+    def __init__(self, ingredients):
+        self.ingredients = sorted(ingredients,
+                                  key=lambda item: item.name.casefold())
+        self.names = [item.name.casefold() for item in self.ingredients]
+
+    def search(self, query, limit=INGREDIENT_SEARCH_LIMIT):
+        """Ingredients with names starting with query, then containing it"""
+        query = query.casefold()
+        start = bisect_left(self.names, query)
+        end = bisect_left(self.names, query + PREFIX_END, lo=start)
+        found = self.ingredients[start:min(end, start + limit)]
+        if len(found) < limit:
+            found += islice(
+                (self.ingredients[number]
+                 for number, name in enumerate(self.names)
+                 if query in name and not start <= number < end),
+                limit - len(found),
+            )
+        return found
+
+
+_index = (None, None)
+_index_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    """Index of the current ingredients version, rebuilt when it changes"""
+    global _index
+    version = get_version(INGREDIENTS_VERSION)
+    if _index[0] == version:
+        return _index[1]
+    with _index_lock:
+        if _index[0] != version:
+            with primary_reads():
+                _index = (version, IngredientIndex(Ingredient.objects.all()))
+    return _index[1]
+
+
+def search_ingredients(query, limit=INGREDIENT_SEARCH_LIMIT):
+    return get_ingredient_index().search(query, limit)
+
+
+def preload_ingredient_index():
+    """Build the index before workers fork to share it between them"""
+    try:
+        get_ingredient_index()
+    except DatabaseError:
+        logger.warning('Ingredient search index is not built')
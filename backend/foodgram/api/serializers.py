@@ -1,9 +1,19 @@
+from operator import attrgetter
+
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
+from django.db import transaction
 from rest_framework import serializers
 
 from . import fields
-from .models import Ingredient, IngredientInRecipe, Recipe, Subscription, Tag
+from .caches import (
+    RECIPES_VERSION, bump_recipe_carts, bump_recipe_version, bump_version,
+)
+from .models import (
+    Ingredient, IngredientInRecipe, Recipe, ShopListJob, Subscription, Tag,
+)
+from .signals import bulk_ingredients_change
+from .utils import get_latest_recipes, set_prefetched
 from .validators import MinValueForFieldValidator, UniqueManyFieldsValidator
 
 User = get_user_model()
@@ -18,7 +28,7 @@ class UserReadSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         if hasattr(obj, 'is_subscribed'):
-            return obj.is_subscribed > 0
+            return obj.is_subscribed
         else:
             request = self.context.get('request')
             if request is None or request.user.is_anonymous:
@@ -57,8 +67,18 @@ class IngredientInRecipeReadSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class IngredientInRecipeWriteListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        """Load all the ingredients before validating them one by one"""
+        if isinstance(data, list):
+            self.child.fields['id'].preload(
+                item.get('id') for item in data if isinstance(item, dict)
+            )
+        return super().to_internal_value(data)
+
+
 class IngredientInRecipeWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = fields.BulkPrimaryKeyRelatedField(
         queryset=Ingredient.objects.all()
     )
     amount = serializers.IntegerField()
@@ -66,6 +86,7 @@ class IngredientInRecipeWriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientInRecipe
         fields = ('id', 'amount')
+        list_serializer_class = IngredientInRecipeWriteListSerializer
         validators = (
             MinValueForFieldValidator(
                 min_value=1,
@@ -99,31 +120,36 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = serializers.ImageField(use_url=True)
+    renditions = fields.RenditionsField()
 
     def get_is_favorited(self, obj):
-        return obj.is_favorited > 0
+        return obj.is_favorited
 
     def get_is_in_shopping_cart(self, obj):
-        return obj.is_in_shopping_cart > 0
+        return obj.is_in_shopping_cart
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('modified', 'favorites_count', 'in_carts_count')
 
 
 class RecipeReadPartialSerializer(serializers.ModelSerializer):
+    renditions = fields.RenditionsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'renditions', 'cooking_time')
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     ingredients = IngredientInRecipeWriteSerializer(many=True,
                                                     allow_empty=False)
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all(),
-                                              allow_empty=False)
-    image = fields.Base64ImageField()
+    tags = fields.BulkPrimaryKeyRelatedField(many=True,
+                                             queryset=Tag.objects.all(),
+                                             allow_empty=False)
+    image = fields.Base64ImageField(
+        upload_to=Recipe._meta.get_field('image').upload_to,
+    )
     author = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
         default=serializers.CurrentUserDefault(),
@@ -160,16 +186,18 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         traverse_errors(self.errors, '')
         return flat_errors
 
+    @transaction.atomic
     def create(self, validated_data):
         recipe = Recipe.objects.create(
             **{field: value
                for field, value in validated_data.items()
                if field not in ('ingredients', 'tags')}
         )
-        self.update_ingredients(recipe, validated_data)
-        self.update_tags(recipe, validated_data)
+        self.update_ingredients(recipe, validated_data, created=True)
+        self.update_tags(recipe, validated_data, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         self.update_tags(instance, validated_data)
         self.update_ingredients(instance, validated_data)
@@ -180,42 +208,117 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
              if key not in ('ingredients', 'tags')},
         )
 
-    def update_ingredients(self, instance, validated_data):
+    def update_ingredients(self, instance, validated_data, created=False):
+        """
+        Write only the difference with amounts of the recipe. Bulk queries
+        send no signals, so caches are invalidated here. Resulting amounts
+        are left in the prefetch cache of the recipe for the response
+        """
         ingredients = validated_data.get('ingredients')
-        if ingredients is not None:
-            instance.ingredients.clear()
-            for ingredient, amount in (
-                (ingredient['id'], {'amount': ingredient['amount']})
-                for ingredient in ingredients
-            ):
-                instance.ingredients.add(ingredient, through_defaults=amount)
-
-    def update_tags(self, instance, validated_data):
+        if ingredients is None:
+            return
+        objects = {item['id'].id: item['id'] for item in ingredients}
+        amounts = {item['id'].id: item['amount'] for item in ingredients}
+        existing = {} if created else {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.filter(recipe=instance)
+        }
+        new = [IngredientInRecipe(recipe=instance,
+                                  ingredient=objects[ingredient_id],
+                                  amount=amount)
+               for ingredient_id, amount in amounts.items()
+               if ingredient_id not in existing]
+        kept, changed = [], []
+        for ingredient_id, row in existing.items():
+            if ingredient_id not in amounts:
+                continue
+            row.ingredient = objects[ingredient_id]
+            kept.append(row)
+            if amounts[ingredient_id] != row.amount:
+                row.amount = amounts[ingredient_id]
+                changed.append(row)
+        removed = [row.id for ingredient_id, row in existing.items()
+                   if ingredient_id not in amounts]
+        if removed:
+            with bulk_ingredients_change():
+                IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if new:
+            IngredientInRecipe.objects.bulk_create(new)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        if new or changed or removed:
+            bump_recipe_carts(instance.pk)
+            bump_recipe_version(instance.pk)
+            bump_version(RECIPES_VERSION)
+        set_prefetched(instance, 'ingredientinrecipe_set', kept + new)
+
+    def update_tags(self, instance, validated_data, created=False):
         tags = validated_data.get('tags')
-        if tags is not None:
-            instance.tags.set(tags)
+        if tags is None:
+            return
+        through = Recipe.tags.through
+        tag_ids = {tag.id for tag in tags}
+        existing = set() if created else set(through.objects.filter(
+            recipe=instance
+        ).values_list('tag_id', flat=True))
+        if existing - tag_ids:
+            through.objects.filter(recipe=instance,
+                                   tag_id__in=existing - tag_ids).delete()
+        if tag_ids - existing:
+            through.objects.bulk_create(
+                through(recipe=instance, tag_id=tag_id)
+                for tag_id in tag_ids - existing
+            )
+        if tag_ids != existing:
+            bump_recipe_version(instance.pk)
+            bump_version(RECIPES_VERSION)
+        set_prefetched(instance, 'tags', sorted(tags, key=attrgetter('name')))
+
+
+class UserSubscribeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """Load recipes of all the authors before serializing them"""
+        authors = list(data)
+        self.child.latest_recipes = get_latest_recipes(
+            [author.id for author in authors],
+            self.child.get_recipes_limit(),
+        )
+        return super().to_representation(authors)
 
 
 class UserSubscribeSerializer(UserReadSerializer):
     recipes = serializers.SerializerMethodField()
     recipe_count = serializers.SerializerMethodField()
 
-    def get_recipe_count(self, obj):
-        limit = self.context['request'].query_params.get('recipes_limit')
-        all = obj.recipes.count()
+    def get_recipes_limit(self):
         try:
-            limit = int(limit)
+            limit = int(
+                self.context['request'].query_params.get('recipes_limit')
+            )
         except (TypeError, ValueError):
-            return all
-        return limit if 0 <= limit < all else all
+            return None
+        return limit if limit >= 0 else None
+
+    def get_recipe_count(self, obj):
+        limit = self.get_recipes_limit()
+        all = obj.recipes_count
+        return limit if limit is not None and limit < all else all
 
     def get_recipes(self, obj):
-        return RecipeReadPartialSerializer(
-            obj.recipes.all()[:self.get_recipe_count(obj)],
-            many=True,
-        ).data
+        if hasattr(self, 'latest_recipes'):
+            recipes = self.latest_recipes[obj.id]
+        else:
+            recipes = obj.recipes.all()[:self.get_recipe_count(obj)]
+        return RecipeReadPartialSerializer(recipes, many=True).data
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipe_count')
+        list_serializer_class = UserSubscribeListSerializer
+
+
+class ShopListJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShopListJob
+        fields = ('id', 'status', 'created', 'finished')
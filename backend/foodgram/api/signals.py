@@ -0,0 +1,258 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .caches import (
+    INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION, USERS_VERSION,
+    bump_auth_version, bump_cart_version, bump_flags_version,
+    bump_recipe_carts, bump_recipe_version, bump_user_version, bump_version,
+)
+from .counters import change_counter
+from .images import renditions_outdated, schedule_renditions
+from .models import Ingredient, IngredientInRecipe, Recipe, Subscription, Tag
+from .replicas import pin_to_primary
+
+User = get_user_model()
+USER_SHOP_LIST_FIELDS = {'first_name', 'last_name'}
+USER_PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+USER_RECIPES_COUNTERS = {
+    User.favorite_recipes.through: 'favorites_count',
+    User.shopping_cart_recipes.through: 'in_carts_count',
+}
+
+ingredients_in_bulk = ContextVar('ingredients_in_bulk', default=False)
+
+
+@contextmanager
+def bulk_ingredients_change():
+    """
+    Skip per row invalidation of recipe ingredients, the caller bumps
+    the versions once for the whole change
+    """
+    token = ingredients_in_bulk.set(True)
+    try:
+        yield
+    finally:
+        ingredients_in_bulk.reset(token)
+
+
+@receiver(m2m_changed, sender=User.shopping_cart_recipes.through)
+def shopping_cart_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        bump_cart_version(instance.pk)
+    elif action == 'pre_clear':
+        bump_recipe_carts(instance.pk)
+    else:
+        bump_cart_version(*pk_set)
+
+
+@receiver(m2m_changed, sender=User.shopping_cart_recipes.through)
+@receiver(m2m_changed, sender=User.favorite_recipes.through)
+def user_recipes_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        bump_flags_version(instance.pk)
+    elif action == 'pre_clear':
+        bump_flags_version(*sender.objects.filter(
+            recipe=instance
+        ).values_list('user_id', flat=True))
+    else:
+        bump_flags_version(*pk_set)
+
+
+@receiver(m2m_changed, sender=User.shopping_cart_recipes.through)
+@receiver(m2m_changed, sender=User.favorite_recipes.through)
+def user_recipes_counted(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """
+    Count added relations after they are inserted and removed ones before
+    they are deleted, pk_set of removal may have ids which are not related
+    """
+    field = USER_RECIPES_COUNTERS[sender]
+    if action == 'post_add':
+        if not reverse:
+            change_counter(Recipe.objects.filter(id__in=pk_set), field, 1)
+        else:
+            change_counter(Recipe.objects.filter(pk=instance.pk),
+                           field,
+                           len(pk_set))
+        return
+    if action not in ('pre_remove', 'pre_clear'):
+        return
+    relations = sender.objects.filter(
+        **{'recipe' if reverse else 'user': instance}
+    )
+    if action == 'pre_remove':
+        relations = relations.filter(
+            **{'user_id__in' if reverse else 'recipe_id__in': pk_set}
+        )
+    if not reverse:
+        change_counter(Recipe.objects.filter(
+            id__in=relations.values('recipe_id')
+        ), field, -1)
+    else:
+        change_counter(Recipe.objects.filter(pk=instance.pk),
+                       field,
+                       -relations.count())
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscription_changed(sender, instance, signal, created=False,
+                         **kwargs):
+    bump_flags_version(instance.subscriber_id)
+    if created or signal is post_delete:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'subscribers_count',
+                       1 if created else -1)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_counted(sender, instance, signal, created=False, **kwargs):
+    if created or signal is post_delete:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'recipes_count',
+                       1 if created else -1)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted_relations(sender, instance, **kwargs):
+    """Relations of a deleted user are removed without m2m_changed"""
+    for through, field in USER_RECIPES_COUNTERS.items():
+        change_counter(Recipe.objects.filter(
+            id__in=through.objects.filter(user=instance).values('recipe_id')
+        ), field, -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    bump_recipe_carts(instance.pk)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def ingredient_in_recipe_changed(sender, instance, **kwargs):
+    if ingredients_in_bulk.get():
+        return
+    bump_recipe_carts(instance.recipe_id)
+    bump_recipe_version(instance.recipe_id)
+    bump_version(RECIPES_VERSION)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    bump_recipe_version(instance.pk)
+    bump_version(RECIPES_VERSION)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_image_replaced(sender, instance, **kwargs):
+    """Copies of the former image are dropped in the same save"""
+    if instance.renditions and renditions_outdated(instance):
+        instance.renditions = {}
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    if renditions_outdated(instance):
+        schedule_renditions(instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if action == 'pre_clear' and reverse:
+        bump_recipe_version(*instance.recipes.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_recipe_version(instance.pk)
+    elif pk_set:
+        bump_recipe_version(*pk_set)
+    bump_version(RECIPES_VERSION)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    bump_version(TAGS_VERSION)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    bump_version(INGREDIENTS_VERSION)
+
+
+def remember_public_fields(instance):
+    """Keep loaded public values to compare them on the next save"""
+    instance._saved_public_fields = {
+        field: instance.__dict__[field]
+        for field in USER_PUBLIC_FIELDS if field in instance.__dict__
+    }
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    remember_public_fields(instance)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    """Only changed public fields invalidate data shown to others"""
+    saved = instance._saved_public_fields
+    fields = USER_PUBLIC_FIELDS.intersection(
+        USER_PUBLIC_FIELDS if update_fields is None else update_fields
+    )
+    changed = USER_PUBLIC_FIELDS if created else {
+        field for field in fields
+        if field in instance.__dict__ and (
+            field not in saved or saved[field] != instance.__dict__[field]
+        )
+    }
+    remember_public_fields(instance)
+    if not created and USER_SHOP_LIST_FIELDS & changed:
+        bump_cart_version(instance.pk)
+    if changed:
+        bump_user_version(instance.pk)
+        bump_version(USERS_VERSION)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    bump_user_version(instance.pk)
+    bump_version(USERS_VERSION)
+
+
+@receiver(post_save, sender=User)
+def user_auth_changed(sender, instance, created, update_fields, **kwargs):
+    """Password, activity and other fields kept by token authentication"""
+    if not created and set(update_fields or ()) != {'last_login'}:
+        bump_auth_version(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Logout deletes tokens of the user"""
+    bump_auth_version(instance.user_id)
+
+
+@receiver(user_logged_in)
+def user_logged_in_pinned(sender, user, **kwargs):
+    """A user who has just signed up reads the new account from the primary"""
+    pin_to_primary(user.pk)
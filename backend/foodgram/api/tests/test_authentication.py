@@ -0,0 +1,112 @@
+import pytest
+from django.contrib.auth.hashers import check_password
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from .conftest import EMAIL, PASSWORD
+from api.authentication import CachedTokenAuthentication, TokenCache
+from api.caches import AUTH_TOKEN_STATS, AUTH_VERSION, VERSION_KEY, get_stats
+
+TAGS_URL = reverse('tags-list')
+USERS_ME_URL = reverse('users-me')
+TOKEN_LOGOUT_URL = reverse('logout')
+USERS_SET_PASSWORD_URL = reverse('users-set-password')
+NEW_PASSWORD = 'password_for_this_test_only'
+TOKEN_TABLE = Token._meta.db_table
+
+
+@pytest.fixture(autouse=True)
+def clear_tokens():
+    CachedTokenAuthentication.tokens.clear()
+    CachedTokenAuthentication.tokens.flush_stats()
+
+
+def token_queried(client, url=TAGS_URL, expected=status.HTTP_200_OK):
+    with CaptureQueriesContext(connection) as context:
+        assert client.get(url).status_code == expected
+    return any(TOKEN_TABLE in query['sql'] for query in context)
+
+
+def test_token_cached(user_client):
+    """Токен ищется в базе только при первом запросе."""
+    assert token_queried(user_client)
+    assert not token_queried(user_client)
+    assert user_client.get(USERS_ME_URL).data['email'] == EMAIL
+    CachedTokenAuthentication.tokens.flush_stats()
+    stats = get_stats(AUTH_TOKEN_STATS)
+    assert (stats['hits'], stats['misses']) == (2, 1)
+
+
+def test_token_cache_logout(user_client,
+                            django_capture_on_commit_callbacks):
+    """После выхода закэшированный токен больше не действует."""
+    token_queried(user_client)
+    with django_capture_on_commit_callbacks(execute=True):
+        assert user_client.post(TOKEN_LOGOUT_URL).status_code == (
+            status.HTTP_204_NO_CONTENT
+        )
+    token_queried(user_client, USERS_ME_URL, status.HTTP_401_UNAUTHORIZED)
+
+
+def test_token_cache_set_password(user_client, setup_user,
+                                  django_capture_on_commit_callbacks):
+    """Смена пароля сбрасывает кэш и не портит остальные поля."""
+    setup_user.recipes_count = 5
+    setup_user.save(update_fields=('recipes_count',))
+    token_queried(user_client)
+    with django_capture_on_commit_callbacks(execute=True):
+        assert user_client.post(USERS_SET_PASSWORD_URL, {
+            'current_password': PASSWORD,
+            'new_password': NEW_PASSWORD,
+        }, format='json').status_code == status.HTTP_204_NO_CONTENT
+    assert token_queried(user_client)
+    setup_user.refresh_from_db()
+    assert check_password(NEW_PASSWORD, setup_user.password)
+    assert setup_user.recipes_count == 5
+
+
+def test_token_cache_deactivation(user_client, setup_user,
+                                  django_capture_on_commit_callbacks):
+    """Отключенный пользователь сразу теряет доступ."""
+    token_queried(user_client)
+    setup_user.is_active = False
+    with django_capture_on_commit_callbacks(execute=True):
+        setup_user.save()
+    token_queried(user_client, USERS_ME_URL, status.HTTP_401_UNAUTHORIZED)
+
+
+def test_token_cache_bumped_by_other_process(user_client, setup_user):
+    """Версия, увеличенная другим процессом в кэше, сбрасывает токен."""
+    token_queried(user_client)
+    other_process_cache = caches.create_connection(DEFAULT_CACHE_ALIAS)
+    assert other_process_cache is not caches[DEFAULT_CACHE_ALIAS]
+    other_process_cache.incr(
+        VERSION_KEY.format(name=AUTH_VERSION.format(user=setup_user.id))
+    )
+    assert token_queried(user_client)
+    assert not token_queried(user_client)
+
+
+def test_token_cache_shared(user_client, settings):
+    """Другой процесс берет пользователя из общего кэша."""
+    settings.TOKEN_CACHE_SHARED = True
+    token_queried(user_client)
+    CachedTokenAuthentication.tokens.clear()
+    assert not token_queried(user_client)
+
+
+def test_token_cache_bounds(settings):
+    """Кэш ограничен по размеру и времени жизни записей."""
+    tokens = TokenCache()
+    settings.TOKEN_CACHE_SIZE = 2
+    for digest in ('first', 'second', 'third'):
+        tokens.set(digest, {'id': digest}, 1)
+    assert tokens.get('first') is None
+    assert tokens.get('third') == ({'id': 'third'}, 1)
+    settings.TOKEN_CACHE_TIMEOUT = -1
+    tokens.set('second', {'id': 'second'}, 1)
+    assert tokens.get('second') is None
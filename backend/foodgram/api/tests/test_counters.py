@@ -0,0 +1,84 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from .conftest import RECIPE_COOKING_TIME, RECIPE_NAME, RECIPE_TEXT
+from api.counters import recompute_counters
+from api.models import Recipe, Subscription
+
+RELATIONS = (
+    ('favorite_recipes', 'users_have_in_favorite', 'favorites_count'),
+    ('shopping_cart_recipes', 'users_have_in_shopping_cart',
+     'in_carts_count'),
+)
+
+
+def counter(instance, field):
+    return type(instance).objects.values_list(field, flat=True).get(
+        pk=instance.pk
+    )
+
+
+@pytest.mark.parametrize('relation, reverse_relation, field', RELATIONS)
+def test_counters_user_recipes(setup_user, setup_user_other, setup_recipe,
+                               relation, reverse_relation, field):
+    """Счетчики избранного и корзины следуют за изменениями связей."""
+    other_recipe = Recipe.objects.create(author=setup_user_other,
+                                         name=RECIPE_NAME,
+                                         image='other',
+                                         text=RECIPE_TEXT,
+                                         cooking_time=RECIPE_COOKING_TIME)
+    getattr(setup_user, relation).add(setup_recipe)
+    getattr(setup_user, relation).add(setup_recipe)
+    getattr(setup_recipe, reverse_relation).add(setup_user_other)
+    assert counter(setup_recipe, field) == 2
+    getattr(setup_user, relation).remove(setup_recipe, other_recipe)
+    assert counter(setup_recipe, field) == 1
+    assert counter(other_recipe, field) == 0
+    getattr(setup_user, relation).add(setup_recipe, other_recipe)
+    getattr(setup_recipe, reverse_relation).remove(setup_user_other)
+    assert counter(setup_recipe, field) == 1
+    getattr(setup_user, relation).clear()
+    assert counter(setup_recipe, field) == 0
+    assert counter(other_recipe, field) == 0
+    getattr(setup_recipe, reverse_relation).add(setup_user,
+                                                setup_user_other)
+    getattr(setup_recipe, reverse_relation).clear()
+    assert counter(setup_recipe, field) == 0
+    getattr(setup_user_other, relation).set([setup_recipe, other_recipe])
+    setup_user_other.delete()
+    assert counter(setup_recipe, field) == 0
+
+
+def test_counters_user_recipes_and_subscribers(setup_user, setup_user_other,
+                                               setup_recipe):
+    """Счетчики рецептов и подписчиков автора следуют за изменениями."""
+    assert counter(setup_user, 'recipes_count') == 1
+    subscription = Subscription.objects.create(author=setup_user,
+                                               subscriber=setup_user_other)
+    subscription.save()
+    assert counter(setup_user, 'subscribers_count') == 1
+    Subscription.objects.filter(author=setup_user).delete()
+    assert counter(setup_user, 'subscribers_count') == 0
+    setup_recipe.save()
+    setup_recipe.delete()
+    assert counter(setup_user, 'recipes_count') == 0
+
+
+def test_counters_recompute(setup_user, setup_user_other, setup_recipe):
+    """Команда пересчета находит и исправляет расхождения счетчиков."""
+    setup_user.favorite_recipes.add(setup_recipe)
+    Recipe.objects.update(favorites_count=5)
+    Subscription.objects.bulk_create((
+        Subscription(author=setup_user, subscriber=setup_user_other),
+    ))
+    out = StringIO()
+    call_command('recompute_counters', '--check', stdout=out)
+    assert 'Recipe.favorites_count: 1 rows drifted' in out.getvalue()
+    assert 'User.subscribers_count: 1 rows drifted' in out.getvalue()
+    assert counter(setup_recipe, 'favorites_count') == 5
+    call_command('recompute_counters', stdout=StringIO())
+    assert counter(setup_recipe, 'favorites_count') == 1
+    assert counter(setup_user, 'subscribers_count') == 1
+    assert all(not total for _, _, total in recompute_counters(fix=False))
@@ -0,0 +1,352 @@
+import base64
+import hashlib
+import os
+import tracemalloc
+from io import BytesIO, StringIO
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+from rest_framework import serializers, status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .conftest import (
+    INGREDIENT_AMOUNT, RECIPE_COOKING_TIME, RECIPE_NAME, RECIPE_TEXT,
+)
+from api.fields import (
+    VALIDATION_ERROR_IMAGE_FORMAT, get_image_format, get_image_size_error,
+)
+from api.images import (
+    RENDITION_FORMATS, RENDITION_SIZES, get_rendition_names,
+    iter_rendition_names, make_renditions,
+)
+from api.models import Recipe
+from api.views import RecipeViewSet
+
+PHOTO_SIZE = (4000, 3000)
+EXIF_ORIENTATION = 0x0112
+EXIF_ORIENTATION_ROTATED = 6
+EXIF_MAKE = 0x010F
+RECIPES_URL = reverse('recipes-list')
+UPLOAD_IMAGE_SIDE = 1200
+UPLOAD_IMAGE_MAX_SIZE = 1024
+RECIPE_IMAGE_BASE64 = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+def make_photo():
+    """Big JPEG with EXIF, rotated by its orientation tag"""
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = EXIF_ORIENTATION_ROTATED
+    exif[EXIF_MAKE] = 'Camera'
+    buffer = BytesIO()
+    Image.new('RGB', PHOTO_SIZE, 'red').save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    return tmp_path
+
+
+def test_make_renditions():
+    """Копии уменьшены, повернуты по EXIF и сохранены без EXIF."""
+    photo = make_photo()
+    renditions = make_renditions(photo)
+    assert set(renditions) == set(RENDITION_SIZES)
+    for size, files in renditions.items():
+        assert set(files) == set(RENDITION_FORMATS)
+        for extension, content in files.items():
+            assert len(content) < len(photo)
+            with Image.open(BytesIO(content)) as image:
+                assert image.format == RENDITION_FORMATS[extension][0]
+                assert max(image.size) == max(RENDITION_SIZES[size])
+                assert image.width < image.height
+                assert not image.getexif()
+
+
+def test_renditions_on_create(user_client, setup_ingredient, setup_tag,
+                              media_root, django_capture_on_commit_callbacks):
+    """Копии картинки появляются после создания рецепта."""
+    with django_capture_on_commit_callbacks(execute=True):
+        response = user_client.post(RECIPES_URL, {
+            'ingredients': [{'id': setup_ingredient.id,
+                             'amount': INGREDIENT_AMOUNT}],
+            'tags': [setup_tag.id],
+            'image': RECIPE_IMAGE_BASE64,
+            'name': RECIPE_NAME,
+            'text': RECIPE_TEXT,
+            'cooking_time': RECIPE_COOKING_TIME,
+        }, format='json')
+    assert response.data['renditions'] == {}
+    recipe = Recipe.objects.get(id=response.data['id'])
+    assert recipe.renditions == get_rendition_names(recipe.image.name)
+    for names in recipe.renditions.values():
+        for name in names.values():
+            assert default_storage.exists(name)
+    renditions = user_client.get(
+        reverse('recipes-detail', args=[recipe.id])
+    ).data['renditions']
+    assert renditions['card']['webp'].startswith('http://testserver/')
+    assert renditions['card']['webp'].endswith(
+        recipe.renditions['card']['webp']
+    )
+
+
+def test_renditions_on_image_replaced(user_client, setup_ingredient,
+                                      setup_tag, media_root,
+                                      django_capture_on_commit_callbacks):
+    """Копии прежней картинки не перечисляются после ее замены."""
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe_id = user_client.post(RECIPES_URL, {
+            **recipe_form(setup_ingredient, setup_tag, RECIPE_IMAGE_BASE64),
+            'ingredients': [{'id': setup_ingredient.id,
+                             'amount': INGREDIENT_AMOUNT}],
+        }, format='json').data['id']
+    assert Recipe.objects.get(id=recipe_id).renditions
+    image = make_upload_image(side=UPLOAD_IMAGE_MAX_SIZE // 32)
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = user_client.patch(
+            reverse('recipes-detail', args=[recipe_id]),
+            {'image': SimpleUploadedFile('image.png', image, 'image/png')},
+            format='multipart',
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['renditions'] == {}
+    assert Recipe.objects.get(id=recipe_id).renditions == {}
+    for callback in callbacks:
+        callback()
+    recipe = Recipe.objects.get(id=recipe_id)
+    assert recipe.renditions == get_rendition_names(recipe.image.name)
+
+
+@pytest.mark.parametrize('workers', (0, 1))
+def test_make_renditions_command(setup_recipe, media_root, workers):
+    """Команда создает недостающие копии картинок рецептов."""
+    other = Recipe.objects.create(author=setup_recipe.author,
+                                  name=RECIPE_NAME,
+                                  image='recipes/missing.png',
+                                  text=RECIPE_TEXT,
+                                  cooking_time=RECIPE_COOKING_TIME)
+    setup_recipe.image.save('photo.jpg', ContentFile(make_photo()))
+    stderr = StringIO()
+    call_command('make_renditions', '--workers', str(workers),
+                 stdout=StringIO(), stderr=stderr)
+    setup_recipe.refresh_from_db()
+    assert setup_recipe.renditions == get_rendition_names(
+        setup_recipe.image.name
+    )
+    assert other.image.name in stderr.getvalue()
+    other.refresh_from_db()
+    assert other.renditions == {}
+
+
+def make_upload_image(side=UPLOAD_IMAGE_SIDE):
+    """PNG of noise, which does not compress, a few megabytes big"""
+    buffer = BytesIO()
+    Image.frombytes('RGB', (side, side),
+                    os.urandom(side * side * 3)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def recipe_form(ingredient, tag, image):
+    return {
+        'ingredients[0]id': ingredient.id,
+        'ingredients[0]amount': INGREDIENT_AMOUNT,
+        'tags': [tag.id],
+        'image': image,
+        'name': RECIPE_NAME,
+        'text': RECIPE_TEXT,
+        'cooking_time': RECIPE_COOKING_TIME,
+    }
+
+
+def test_get_image_format():
+    """Формат картинки определяется по первым байтам."""
+    assert get_image_format(make_photo()) == 'jpeg'
+    assert get_image_format(base64.b64decode(
+        RECIPE_IMAGE_BASE64.split(';base64,')[1]
+    )) == 'png'
+    assert get_image_format(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'webp'
+    assert get_image_format(b'<svg></svg>') is None
+
+
+def test_recipes_create_multipart(user_client, setup_ingredient, setup_tag,
+                                  media_root):
+    """Рецепт создается формой с файлом картинки."""
+    image = make_photo()
+    response = user_client.post(RECIPES_URL, recipe_form(
+        setup_ingredient, setup_tag,
+        SimpleUploadedFile('photo.bin', image, 'image/jpeg'),
+    ), format='multipart')
+    assert response.status_code == status.HTTP_201_CREATED
+    recipe = Recipe.objects.get(id=response.data['id'])
+    assert recipe.image.name == (
+        f'recipes/{hashlib.sha256(image).hexdigest()}.jpeg'
+    )
+    assert recipe.image.read() == image
+    assert recipe.ingredientinrecipe_set.get().amount == INGREDIENT_AMOUNT
+    assert [*recipe.tags.all()] == [setup_tag]
+
+
+@pytest.mark.parametrize('content, error', (
+    (b'<svg></svg>', VALIDATION_ERROR_IMAGE_FORMAT),
+    (b'\x89PNG\r\n\x1a\n' + b'0' * UPLOAD_IMAGE_MAX_SIZE, None),
+))
+def test_recipes_create_multipart_invalid(user_client, setup_ingredient,
+                                          setup_tag, media_root, settings,
+                                          content, error):
+    """Картинки неверного формата и слишком большие отклоняются."""
+    settings.RECIPE_IMAGE_MAX_SIZE = UPLOAD_IMAGE_MAX_SIZE
+    response = user_client.post(RECIPES_URL, recipe_form(
+        setup_ingredient, setup_tag,
+        SimpleUploadedFile('image.png', content, 'image/png'),
+    ), format='multipart')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['image'] == [error or get_image_size_error()]
+    assert not Recipe.objects.exists()
+    assert not list(media_root.rglob('*.*'))
+
+
+def test_recipes_create_base64_too_big(user_client, setup_ingredient,
+                                       setup_tag, media_root, settings):
+    """Слишком большая картинка в base64 отклоняется до декодирования."""
+    settings.RECIPE_IMAGE_MAX_SIZE = UPLOAD_IMAGE_MAX_SIZE
+    response = user_client.post(RECIPES_URL, {
+        **recipe_form(setup_ingredient, setup_tag, None),
+        'ingredients': [{'id': setup_ingredient.id,
+                         'amount': INGREDIENT_AMOUNT}],
+        'image': 'data:image/png;base64,' + base64.b64encode(
+            make_upload_image(side=UPLOAD_IMAGE_MAX_SIZE // 32)
+        ).decode(),
+    }, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['image'] == [get_image_size_error()]
+
+
+def upload_peak(user, request):
+    """Peak of python memory while the view handles the request"""
+    force_authenticate(request, user=user)
+    view = RecipeViewSet.as_view({'post': 'create'})
+    tracemalloc.start()
+    response = view(request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    request.close()
+    assert response.status_code == status.HTTP_201_CREATED
+    return peak
+
+
+def test_recipes_upload_memory(setup_user, setup_ingredient, setup_tag,
+                               media_root):
+    """Картинка формой не держится в памяти целиком, в base64 - держится."""
+    image = make_upload_image()
+    factory = APIRequestFactory()
+    multipart_peak = upload_peak(setup_user, factory.post(
+        RECIPES_URL,
+        recipe_form(setup_ingredient, setup_tag,
+                    SimpleUploadedFile('image.png', image, 'image/png')),
+        format='multipart',
+    ))
+    base64_peak = upload_peak(setup_user, factory.post(RECIPES_URL, {
+        **recipe_form(setup_ingredient, setup_tag, None),
+        'ingredients': [{'id': setup_ingredient.id,
+                         'amount': INGREDIENT_AMOUNT}],
+        'image': 'data:image/png;base64,' + base64.b64encode(image).decode(),
+    }, format='json'))
+    assert multipart_peak < len(image) / 4
+    assert base64_peak > len(image)
+
+
+def recipe_images(media_root):
+    return sorted(path.name for path in (media_root / 'recipes').glob('*.*'))
+
+
+def test_recipes_same_image_stored_once(user_client, setup_ingredient,
+                                        setup_tag, media_root):
+    """Одинаковые картинки в base64 и формой хранятся одним файлом."""
+    image = make_upload_image(side=UPLOAD_IMAGE_MAX_SIZE // 32)
+    ids = [
+        user_client.post(RECIPES_URL, recipe_form(
+            setup_ingredient, setup_tag,
+            SimpleUploadedFile('image.png', image, 'image/png'),
+        ), format='multipart').data['id']
+        for _ in range(2)
+    ]
+    ids.append(user_client.post(RECIPES_URL, {
+        **recipe_form(setup_ingredient, setup_tag, None),
+        'ingredients': [{'id': setup_ingredient.id,
+                         'amount': INGREDIENT_AMOUNT}],
+        'image': 'data:image/png;base64,' + base64.b64encode(image).decode(),
+    }, format='json').data['id'])
+    name = f'{hashlib.sha256(image).hexdigest()}.png'
+    assert set(Recipe.objects.filter(id__in=ids).values_list(
+        'image', flat=True
+    )) == {f'recipes/{name}'}
+    assert recipe_images(media_root) == [name]
+
+
+def test_recipes_update_same_image(user_client, setup_ingredient, setup_tag,
+                                   media_root, monkeypatch):
+    """Неизменная картинка при обновлении не декодируется и не пишется."""
+    recipe_id = user_client.post(RECIPES_URL, {
+        **recipe_form(setup_ingredient, setup_tag, RECIPE_IMAGE_BASE64),
+        'ingredients': [{'id': setup_ingredient.id,
+                         'amount': INGREDIENT_AMOUNT}],
+    }, format='json').data['id']
+    image = Recipe.objects.get(id=recipe_id).image.name
+
+    def fail(*args, **kwargs):
+        raise AssertionError
+
+    monkeypatch.setattr(serializers.ImageField, 'to_internal_value', fail)
+    monkeypatch.setattr(FileSystemStorage, 'exists', fail)
+    monkeypatch.setattr(FileSystemStorage, '_save', fail)
+    response = user_client.patch(
+        reverse('recipes-detail', args=[recipe_id]),
+        {'image': RECIPE_IMAGE_BASE64, 'name': RECIPE_NAME * 2},
+        format='json',
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert Recipe.objects.get(id=recipe_id).image.name == image
+
+
+def make_old(media_root, names):
+    for name in names:
+        os.utime(media_root / name, (0, 0))
+
+
+def test_remove_orphan_images(user_client, setup_ingredient, setup_tag,
+                              media_root, django_capture_on_commit_callbacks):
+    """Картинки без рецептов удаляются вместе с копиями."""
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe_id = user_client.post(RECIPES_URL, {
+            **recipe_form(setup_ingredient, setup_tag, RECIPE_IMAGE_BASE64),
+            'ingredients': [{'id': setup_ingredient.id,
+                             'amount': INGREDIENT_AMOUNT}],
+        }, format='json').data['id']
+    old_image = Recipe.objects.get(id=recipe_id).image.name
+    with django_capture_on_commit_callbacks(execute=True):
+        user_client.patch(reverse('recipes-detail', args=[recipe_id]), {
+            'image': SimpleUploadedFile('photo.jpg', make_photo()),
+        }, format='multipart')
+    recipe = Recipe.objects.get(id=recipe_id)
+    kept = {recipe.image.name, *iter_rendition_names(recipe.image.name)}
+    removed = {old_image, *iter_rendition_names(old_image)}
+    fresh = default_storage.save('recipes/fresh.png',
+                                 ContentFile(b'fresh'))
+    make_old(media_root, kept | removed)
+    call_command('remove_orphan_images', '--dry-run', stdout=StringIO())
+    assert all(default_storage.exists(name) for name in removed)
+    stdout = StringIO()
+    call_command('remove_orphan_images', stdout=stdout)
+    assert f'Removed {len(removed)} files' in stdout.getvalue()
+    assert not any(default_storage.exists(name) for name in removed)
+    assert all(default_storage.exists(name) for name in kept | {fresh})
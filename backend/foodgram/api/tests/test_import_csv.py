@@ -0,0 +1,69 @@
+from io import StringIO
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from .conftest import INGREDIENT_MU, INGREDIENT_NAME, TAG_SLUG
+from api.caches import INGREDIENTS_VERSION, get_version
+from api.models import Ingredient, Tag
+
+ROWS = (
+    (INGREDIENT_NAME, INGREDIENT_MU),
+    ('соль', 'г'),
+    ('соль', 'щепотка'),
+    ('соль', 'г'),
+)
+
+
+@pytest.fixture
+def ingredients_csv(tmp_path):
+    file = tmp_path / 'ingredients.csv'
+    file.write_text(
+        ''.join(f'{name},{unit}\n' for name, unit in ROWS) + 'bad row\n',
+        encoding='utf8',
+    )
+    return str(file)
+
+
+def import_csv(*args):
+    stdout = StringIO()
+    call_command('import_csv', *args, verbosity=0, stdout=stdout)
+    return stdout.getvalue()
+
+
+def test_import_csv_idempotent(setup_ingredient, ingredients_csv,
+                               django_capture_on_commit_callbacks):
+    """Повторный импорт не создает дубликаты ингредиентов."""
+    version = get_version(INGREDIENTS_VERSION)
+    with django_capture_on_commit_callbacks(execute=True):
+        output = import_csv(ingredients_csv, '--batch-size', '2')
+    assert 'created 2 of 5' in output
+    assert 'rows/sec' in output
+    assert 'bad row' in output
+    assert Ingredient.objects.count() == 3
+    assert get_version(INGREDIENTS_VERSION) != version
+    import_csv(ingredients_csv)
+    assert Ingredient.objects.count() == 3
+
+
+def test_import_csv_dry_run(db, ingredients_csv):
+    """Пробный импорт ничего не сохраняет, но считает новые строки."""
+    cache.clear()
+    version = get_version(INGREDIENTS_VERSION)
+    assert 'created 3 of 5' in import_csv(ingredients_csv, '--dry-run')
+    assert not Ingredient.objects.exists()
+    assert get_version(INGREDIENTS_VERSION) == version
+
+
+def test_import_csv_model(db, tmp_path):
+    """Импорт в произвольную модель по списку полей."""
+    file = tmp_path / 'tags.csv'
+    file.write_text(f'{TAG_SLUG},1,{TAG_SLUG}\n', encoding='utf8')
+    import_csv(str(file), '--model', 'api.Tag', '--fields', 'name,color,slug')
+    assert Tag.objects.get().slug == TAG_SLUG
+    with pytest.raises(CommandError):
+        import_csv(str(file), '--model', 'api.Tag')
+    with pytest.raises(CommandError):
+        import_csv(str(file), '--model', 'api.Unknown')
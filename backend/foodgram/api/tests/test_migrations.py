@@ -0,0 +1,63 @@
+import pytest
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from .conftest import (
+    EMAIL, INGREDIENT_MU, INGREDIENT_NAME, RECIPE_COOKING_TIME, RECIPE_IMAGE,
+    RECIPE_NAME, RECIPE_TEXT, USERNAME,
+)
+
+BEFORE_MERGE = [('api', '0006_counters')]
+AFTER_MERGE = [('api', '0007_ingredient_unique_ingredient')]
+
+
+def migrate(targets):
+    executor = MigrationExecutor(connection)
+    executor.migrate(targets)
+    executor.loader.build_graph()
+    return executor.loader.project_state(targets).apps
+
+
+@pytest.fixture
+def migrator(transactional_db):
+    yield migrate
+    executor = MigrationExecutor(connection)
+    migrate(executor.loader.graph.leaf_nodes())
+
+
+def test_merge_duplicate_ingredients(migrator):
+    """Дубликаты ингредиента в одном рецепте сливаются в одну строку."""
+    apps = migrator(BEFORE_MERGE)
+    Ingredient = apps.get_model('api', 'Ingredient')  # noqa: N806
+    author = apps.get_model('api', 'User').objects.create(
+        email=EMAIL, username=USERNAME,
+    )
+    recipes = [
+        apps.get_model('api', 'Recipe').objects.create(
+            author=author, name=RECIPE_NAME, image=f'{RECIPE_IMAGE}{number}',
+            text=RECIPE_TEXT, cooking_time=RECIPE_COOKING_TIME,
+        )
+        for number in range(2)
+    ]
+    kept, duplicate = (
+        Ingredient.objects.create(name=INGREDIENT_NAME,
+                                  measurement_unit=INGREDIENT_MU)
+        for _ in range(2)
+    )
+    IngredientInRecipe = apps.get_model(  # noqa: N806
+        'api', 'IngredientInRecipe'
+    )
+    IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(recipe=recipes[0], ingredient=kept, amount=1),
+        IngredientInRecipe(recipe=recipes[0], ingredient=duplicate, amount=2),
+        IngredientInRecipe(recipe=recipes[1], ingredient=duplicate, amount=4),
+    ])
+    apps = migrator(AFTER_MERGE)
+    assert list(apps.get_model('api', 'Ingredient').objects.values_list(
+        'id', flat=True
+    )) == [kept.id]
+    assert sorted(apps.get_model(
+        'api', 'IngredientInRecipe'
+    ).objects.values_list('recipe', 'ingredient', 'amount')) == [
+        (recipes[0].id, kept.id, 3), (recipes[1].id, kept.id, 4),
+    ]
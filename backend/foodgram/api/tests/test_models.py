@@ -1,3 +1,6 @@
+from api.models import ShopListJob
+
+
 def test_user_verbose_names(setup_user):
     """User: verbose_name в полях совпадает с ожидаемым"""
     field_verboses = {
@@ -95,3 +98,18 @@ def test_recipe_verbose_names(setup_recipe):
     assert setup_recipe._meta.verbose_name == 'Рецепт'
     assert setup_recipe._meta.verbose_name_plural == 'Рецепты'
     assert str(setup_recipe) == setup_recipe.name
+
+
+def test_shop_list_job_verbose_names(setup_user):
+    """ShopListJob: verbose_name в полях совпадает с ожидаемым"""
+    job = ShopListJob.objects.create(user=setup_user)
+    field_verboses = {
+        'user': 'Пользователь',
+        'status': 'Статус',
+        'result': 'Список покупок в PDF',
+    }
+    for field, value in field_verboses.items():
+        assert job._meta.get_field(field).verbose_name == value
+    assert job._meta.verbose_name == 'Задача на список покупок'
+    assert job._meta.verbose_name_plural == 'Задачи на список покупок'
+    assert str(job) == f'{setup_user.username}: {job.status}'
@@ -0,0 +1,141 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from .conftest import EMAIL, INGREDIENT_MU, INGREDIENT_NAME, PASSWORD
+from api.models import Ingredient, Recipe, Tag
+from api.replicas import (
+    ReplicaRouter, get_read_database, pin_to_primary, read_database,
+)
+
+pytestmark = pytest.mark.django_db(databases=['default', 'replica'])
+
+TAGS_URL = reverse('tags-list')
+RECIPES_URL = reverse('recipes-list')
+TOKEN_LOGIN_URL = reverse('login')
+USERS_ME_URL = reverse('users-me')
+INGREDIENTS_URL = reverse('ingredients-list')
+RECIPES_DOWNLOAD_SHOPPING_CART = reverse('recipes-download-shopping-cart')
+
+
+@pytest.fixture
+def replica(settings):
+    settings.REPLICA_DATABASES = ['replica']
+    settings.PRIMARY_PIN_TIMEOUT = 60
+    settings.SHARED_CACHE = True
+    return settings
+
+
+def replica_queries(client, url):
+    with CaptureQueriesContext(connections['replica']) as context:
+        response = client.get(url)
+    return response, len(context)
+
+
+def test_replica_router():
+    """Записи идут в основную базу, токены читаются из нее же."""
+    router = ReplicaRouter()
+    assert router.db_for_read(Recipe) == 'default'
+    token = read_database.set('replica')
+    try:
+        assert router.db_for_read(Recipe) == 'replica'
+        assert router.db_for_read(Token) == 'default'
+        assert router.db_for_write(Recipe) == 'default'
+    finally:
+        read_database.reset(token)
+
+
+def test_replica_needs_shared_cache(guest_client, setup_tag, replica):
+    """Без общего кэша все читают из основной базы."""
+    replica.SHARED_CACHE = False
+    replica.PRIMARY_PIN_TIMEOUT = 0
+    assert get_read_database(AnonymousUser()) is None
+    response, queries = replica_queries(guest_client, TAGS_URL)
+    assert response.status_code == status.HTTP_200_OK
+    assert not queries
+
+
+def test_replica_reads(guest_client, setup_tag, replica):
+    """Безопасные запросы читают данные из реплики."""
+    replica.PRIMARY_PIN_TIMEOUT = 0
+    response, queries = replica_queries(guest_client, TAGS_URL)
+    assert queries
+    assert response.json() == []
+    assert Tag.objects.exists()
+
+
+def test_replica_recently_modified(guest_client, setup_tag, replica):
+    """Только что измененные данные читаются из основной базы."""
+    response, queries = replica_queries(guest_client, TAGS_URL)
+    assert not queries
+    assert response.json()[0]['id'] == setup_tag.id
+
+
+def test_replica_pinned_after_write(user_client, user_client_other,
+                                    setup_user, setup_user_other,
+                                    setup_recipe, replica):
+    """Пользователь после записи читает из основной базы, другие - нет."""
+    assert user_client.get(
+        reverse('recipes-favorite', args=[setup_recipe.id])
+    ).status_code == status.HTTP_201_CREATED
+    assert get_read_database(setup_user) is None
+    assert get_read_database(setup_user_other) == 'replica'
+    replica.PRIMARY_PIN_TIMEOUT = 0
+    response, queries = replica_queries(
+        user_client, reverse('recipes-detail', args=[setup_recipe.id])
+    )
+    assert not queries
+    assert response.data['is_favorited']
+    response, queries = replica_queries(user_client_other, RECIPES_URL)
+    assert queries
+    assert response.data['results'] == []
+
+
+def test_replica_pinned_after_login(guest_client, setup_user, replica):
+    """Вошедший пользователь сразу читает свои данные из основной базы."""
+    token = guest_client.post(TOKEN_LOGIN_URL, {
+        'email': EMAIL,
+        'password': PASSWORD,
+    }, format='json').data['auth_token']
+    guest_client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+    response, queries = replica_queries(guest_client, USERS_ME_URL)
+    assert not queries
+    assert response.data['email'] == EMAIL
+
+
+def test_replica_lag_ingredient_index(guest_client, replica,
+                                      django_capture_on_commit_callbacks):
+    """Индекс ингредиентов строится по основной базе."""
+    with django_capture_on_commit_callbacks(execute=True):
+        Ingredient.objects.create(name=INGREDIENT_NAME,
+                                  measurement_unit=INGREDIENT_MU)
+    replica.PRIMARY_PIN_TIMEOUT = 0
+    response = guest_client.get(INGREDIENTS_URL, {'name': INGREDIENT_NAME})
+    assert [item['name'] for item in response.data] == [INGREDIENT_NAME]
+
+
+def test_replica_lag_shop_list(user_client_recipe_in_cart, replica):
+    """Список покупок собирается по основной базе."""
+    replica.PRIMARY_PIN_TIMEOUT = 0
+    with mock.patch(
+        'api.utils.create_shop_list',
+        side_effect=lambda user, ingredients: repr(list(ingredients)).encode()
+    ):
+        response = user_client_recipe_in_cart.get(
+            RECIPES_DOWNLOAD_SHOPPING_CART
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert INGREDIENT_NAME in b''.join(response.streaming_content).decode()
+
+
+def test_replica_pin_expires(setup_user, replica):
+    """Привязка к основной базе действует ограниченное время."""
+    replica.PRIMARY_PIN_TIMEOUT = -1
+    pin_to_primary(setup_user.id)
+    assert get_read_database(setup_user) == 'replica'
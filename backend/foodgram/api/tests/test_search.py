@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+from django.urls import reverse
+
+from .conftest import INGREDIENT_MU
+from api.models import Ingredient
+from api.search import IngredientIndex
+
+INGREDIENTS_URL = reverse('ingredients-list')
+NAMES = ('Сахар', 'сахарная пудра', 'ванильный сахар', 'сало',
+         'тростниковый сахар', 'соль')
+
+
+@pytest.fixture()
+def setup_ingredients(db):
+    return Ingredient.objects.bulk_create(
+        Ingredient(name=name, measurement_unit=INGREDIENT_MU)
+        for name in NAMES
+    )
+
+
+@pytest.mark.parametrize('query, limit, found', (
+    ('сах', 10, ['Сахар', 'сахарная пудра', 'ванильный сахар',
+                 'тростниковый сахар']),
+    ('САХАР', 3, ['Сахар', 'сахарная пудра', 'ванильный сахар']),
+    ('са', 2, ['сало', 'Сахар']),
+    ('ль', 10, ['ванильный сахар', 'соль']),
+    ('мука', 10, []),
+))
+def test_ingredient_index_search(query, limit, found):
+    """Сначала идут совпадения с начала названия, затем по подстроке."""
+    index = IngredientIndex(SimpleNamespace(name=name) for name in NAMES)
+    assert [item.name for item in index.search(query, limit)] == found
+
+
+def test_ingredients_search(guest_client, setup_ingredients,
+                            django_assert_num_queries,
+                            django_capture_on_commit_callbacks):
+    """Поиск ингредиентов не обращается к базе после построения индекса."""
+    guest_client.get(INGREDIENTS_URL, {'name': 'сах'})
+    with django_assert_num_queries(0):
+        response = guest_client.get(INGREDIENTS_URL, {'name': 'сах'})
+    assert [item['name'] for item in response.data][:2] == [
+        'Сахар', 'сахарная пудра',
+    ]
+    assert response.data[0]['measurement_unit'] == INGREDIENT_MU
+    with django_capture_on_commit_callbacks(execute=True):
+        Ingredient.objects.create(name='Сахарин',
+                                  measurement_unit=INGREDIENT_MU)
+    assert 'Сахарин' in [
+        item['name']
+        for item in guest_client.get(INGREDIENTS_URL, {'name': 'сах'}).data
+    ]
+
+
+@pytest.mark.parametrize('field, value', (
+    ('name', 'Сахар тростниковый'), ('measurement_unit', 'кг'),
+))
+def test_ingredients_search_changed(guest_client, setup_ingredients, field,
+                                    value,
+                                    django_capture_on_commit_callbacks):
+    """Индекс перестраивается после изменения ингредиента."""
+    guest_client.get(INGREDIENTS_URL, {'name': 'сах'})
+    ingredient = setup_ingredients[0]
+    setattr(ingredient, field, value)
+    with django_capture_on_commit_callbacks(execute=True):
+        ingredient.save()
+    found = guest_client.get(INGREDIENTS_URL, {'name': 'сах'}).data
+    assert {'id': ingredient.id, 'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit} in found
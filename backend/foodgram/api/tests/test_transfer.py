@@ -0,0 +1,94 @@
+import json
+from io import StringIO
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from .conftest import (
+    EMAIL, INGREDIENT_AMOUNT, RECIPE_COOKING_TIME, RECIPE_NAME, RECIPE_TEXT,
+    TAG_SLUG,
+)
+from api.models import Recipe, User
+
+IMAGE_CONTENT = b'recipe image'
+RECIPES_TOTAL = 3
+
+
+@pytest.fixture
+def setup_recipes(settings, tmp_path, setup_recipe):
+    settings.MEDIA_ROOT = tmp_path
+    setup_recipe.image.save('recipe.png', ContentFile(IMAGE_CONTENT))
+    for number in range(1, RECIPES_TOTAL):
+        recipe = Recipe.objects.create(author=setup_recipe.author,
+                                       name=f'{RECIPE_NAME} {number}',
+                                       image=f'recipes/{number}.png',
+                                       text=RECIPE_TEXT,
+                                       cooking_time=RECIPE_COOKING_TIME)
+        recipe.tags.set(setup_recipe.tags.all())
+    return Recipe.objects.order_by('id')
+
+
+def export_recipes(*args):
+    stdout = StringIO()
+    call_command('export_recipes', *args, stdout=stdout)
+    return stdout.getvalue()
+
+
+def import_recipes(file, *args):
+    stdout = StringIO()
+    call_command('import_recipes', str(file), *args, stdout=stdout)
+    return stdout.getvalue()
+
+
+def test_export_recipes(setup_recipes):
+    """Рецепты выгружаются по одному в строке с автором, тегами и картинкой."""
+    records = [json.loads(line) for line in
+               export_recipes('--chunk-size', '2').splitlines()]
+    assert [record['name'] for record in records] == [
+        recipe.name for recipe in setup_recipes
+    ]
+    assert records[0]['author']['email'] == EMAIL
+    assert records[0]['tags'] == [TAG_SLUG]
+    assert records[0]['ingredients'][0]['amount'] == INGREDIENT_AMOUNT
+    assert 'image_data' in records[0]
+    assert 'image_data' not in records[1]
+    assert all('image_data' not in json.loads(line)
+               for line in export_recipes('--no-images').splitlines())
+
+
+def test_import_recipes(setup_recipes, tmp_path):
+    """Рецепты загружаются обратно вместе с авторами, связями и картинкой."""
+    file = tmp_path / 'recipes.ndjson'
+    export_recipes('--output', str(file))
+    expected = [(recipe.name, recipe.pub_date, [*recipe.tags.all()],
+                 [*recipe.ingredientinrecipe_set.values_list(
+                     'ingredient', 'amount'
+                 )])
+                for recipe in setup_recipes]
+    image = setup_recipes[0].image.name
+    setup_recipes[0].image.delete(save=False)
+    User.objects.all().delete()
+    assert 'Created 3, skipped 0' in import_recipes(file, '--batch-size', '2')
+    recipes = Recipe.objects.order_by('id')
+    assert [(recipe.name, recipe.pub_date, [*recipe.tags.all()],
+             [*recipe.ingredientinrecipe_set.values_list(
+                 'ingredient', 'amount'
+             )])
+            for recipe in recipes] == expected
+    assert recipes[0].image.name == image
+    assert recipes[0].image.read() == IMAGE_CONTENT
+    assert User.objects.get().recipes_count == RECIPES_TOTAL
+    assert 'Created 0, skipped 3' in import_recipes(file)
+    assert Recipe.objects.count() == RECIPES_TOTAL
+
+
+def test_import_recipes_shared_image(setup_recipes, tmp_path):
+    """Рецепты с общей картинкой загружаются каждый отдельно."""
+    setup_recipes.update(image=setup_recipes[0].image.name)
+    file = tmp_path / 'recipes.ndjson'
+    export_recipes('--output', str(file))
+    Recipe.objects.all().delete()
+    assert 'Created 3, skipped 0' in import_recipes(file)
+    assert Recipe.objects.values('image').distinct().count() == 1
+    assert 'Created 0, skipped 3' in import_recipes(file)
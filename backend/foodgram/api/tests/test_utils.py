@@ -0,0 +1,166 @@
+import os
+from contextlib import suppress
+from unittest import mock
+
+import pytest
+from django.db import transaction
+from fpdf import FPDF_FONT_DIR
+from fpdf.ttfonts import TTFontFile
+
+from .conftest import INGREDIENT_AMOUNT, INGREDIENT_MU, INGREDIENT_NAME
+from api.benchmarks import (
+    BENCHMARK_INGREDIENTS_IN_RECIPE, create_ingredients, create_recipes,
+)
+from api.caches import (
+    INGREDIENTS_VERSION, SHOP_LIST_STATS, bump_version, get_stats, get_version,
+)
+from api.models import Ingredient
+from api.serializers import RecipeWriteSerializer
+from api.utils import (
+    PDF_FONT_NAME, FontSubset, ShopListRenderer, aggregate_shop_list,
+    create_shop_list, get_shop_list_pdf,
+)
+
+
+def test_aggregate_shop_list_sums_amounts(setup_user, setup_recipe,
+                                          setup_user_other):
+    """Количества одинаковых ингредиентов в корзине суммируются."""
+    other_recipe_ids = create_recipes(setup_user_other, 2)
+    for recipe_id in other_recipe_ids:
+        setup_user.shopping_cart_recipes.add(recipe_id)
+        setup_recipe.ingredients.through.objects.create(
+            recipe_id=recipe_id,
+            ingredient=setup_recipe.ingredients.get(),
+            amount=1,
+        )
+    setup_user.shopping_cart_recipes.add(setup_recipe)
+    Ingredient.objects.create(name=INGREDIENT_NAME, measurement_unit='кг')
+    assert list(aggregate_shop_list(setup_user)) == [
+        (INGREDIENT_NAME, INGREDIENT_MU, INGREDIENT_AMOUNT + 2),
+    ]
+
+
+def test_aggregate_shop_list_empty_cart(setup_user, setup_recipe):
+    """Пустая корзина дает пустой список покупок."""
+    assert list(aggregate_shop_list(setup_user)) == []
+
+
+@pytest.mark.parametrize('cart_size', (10, 100))
+def test_aggregate_shop_list_single_query(setup_user, cart_size,
+                                          django_assert_num_queries):
+    """Список покупок собирается одним запросом при любом размере корзины."""
+    setup_user.shopping_cart_recipes.add(
+        *create_recipes(setup_user, cart_size, create_ingredients(50))
+    )
+    with django_assert_num_queries(1):
+        rows = list(aggregate_shop_list(setup_user))
+    assert sum(amount for _, _, amount in rows) == (
+        cart_size * sum(range(1, BENCHMARK_INGREDIENTS_IN_RECIPE + 1))
+    )
+
+
+def test_bump_version_on_commit(db, django_capture_on_commit_callbacks):
+    """Версия меняется только после фиксации транзакции."""
+    version = get_version(INGREDIENTS_VERSION)
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        bump_version(INGREDIENTS_VERSION)
+        assert get_version(INGREDIENTS_VERSION) == version
+    assert len(callbacks) == 1
+    assert get_version(INGREDIENTS_VERSION) != version
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        with suppress(RuntimeError), transaction.atomic():
+            bump_version(INGREDIENTS_VERSION)
+            raise RuntimeError
+    assert callbacks == []
+
+
+@pytest.fixture()
+def render_pdf():
+    with mock.patch(
+        'api.utils.create_shop_list',
+        side_effect=lambda user, ingredients: repr(list(ingredients)).encode()
+    ) as render:
+        yield render
+
+
+def test_shop_list_pdf_cached(setup_user, setup_recipe, render_pdf,
+                              django_assert_num_queries):
+    """Повторная загрузка списка покупок не пересобирает PDF."""
+    setup_user.shopping_cart_recipes.add(setup_recipe)
+    pdf = get_shop_list_pdf(setup_user)
+    with django_assert_num_queries(0):
+        assert get_shop_list_pdf(setup_user) == pdf
+    assert render_pdf.call_count == 1
+    assert get_stats(SHOP_LIST_STATS) == {'hits': 1, 'misses': 1,
+                                          'hit_rate': 0.5}
+
+
+def test_shop_list_pdf_invalidated(setup_user, setup_recipe,
+                                   setup_ingredient, render_pdf, subtests,
+                                   django_capture_on_commit_callbacks):
+    """Список покупок пересобирается после изменения корзины."""
+    changes = {
+        'cart add': lambda: setup_user.shopping_cart_recipes.add(
+            setup_recipe
+        ),
+        'ingredient rename': lambda: Ingredient(
+            id=setup_ingredient.id,
+            name=INGREDIENT_NAME.upper(),
+            measurement_unit=INGREDIENT_MU,
+        ).save(),
+        'recipe ingredients': lambda: (
+            RecipeWriteSerializer().update_ingredients(
+                setup_recipe,
+                {'ingredients': [{'id': setup_ingredient, 'amount': 1}]},
+            )
+        ),
+        'cart remove': lambda: setup_user.shopping_cart_recipes.remove(
+            setup_recipe
+        ),
+    }
+    get_shop_list_pdf(setup_user)
+    for number, (change, apply) in enumerate(changes.items(), start=2):
+        with subtests.test(change=change):
+            with django_capture_on_commit_callbacks(execute=True):
+                apply()
+            get_shop_list_pdf(setup_user)
+            assert render_pdf.call_count == number
+
+
+def test_font_subset_without_repeats():
+    """Подмножество шрифта хранит каждый символ один раз."""
+    subset = FontSubset(range(3))
+    for code in (2, 3, 3):
+        subset.append(code)
+    del subset[0]
+    assert subset == [1, 2, 3]
+    assert 0 not in subset
+    assert 3 in subset
+
+
+@pytest.mark.skipif(
+    not os.path.exists(os.path.join(FPDF_FONT_DIR, PDF_FONT_NAME)),
+    reason='Шрифт для PDF не установлен',
+)
+def test_shop_list_renderer_reuses_font(setup_user):
+    """Повторный рендер не перечитывает шрифт."""
+    create_shop_list(setup_user, [(INGREDIENT_NAME, INGREDIENT_MU, 1)])
+    with mock.patch.object(TTFontFile, 'makeSubset') as make_subset:
+        pdf = create_shop_list(setup_user,
+                               [(INGREDIENT_NAME, INGREDIENT_MU, 2)])
+    make_subset.assert_not_called()
+    assert pdf.startswith(b'%PDF')
+
+
+@pytest.mark.skipif(
+    not os.path.exists(os.path.join(FPDF_FONT_DIR, PDF_FONT_NAME)),
+    reason='Шрифт для PDF не установлен',
+)
+def test_shop_list_renderer_keeps_own_subsets(setup_user):
+    """Кэш подмножеств шрифта принадлежит рендереру."""
+    create_shop_list(setup_user, ())
+    renderer = ShopListRenderer()
+    assert renderer.subsets == {}
+    pdf = renderer.render(setup_user, ())
+    assert len(renderer.subsets) == 1
+    assert pdf.startswith(b'%PDF')
@@ -1,11 +1,37 @@
+import base64
+import json
+from types import SimpleNamespace
+from unittest import mock
+
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import SystemCheckError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from api.models import Ingredient, Subscription, Tag
+from .conftest import (
+    EMAIL_OTHER, FIRST_NAME, INGREDIENT_AMOUNT, INGREDIENT_MU, INGREDIENT_NAME,
+    LAST_NAME, PASSWORD, PASSWORD_OTHER, RECIPE_COOKING_TIME, RECIPE_IMAGE,
+    RECIPE_NAME, RECIPE_TEXT, TAG_SLUG, USERNAME, USERNAME_OTHER,
+)
+from api.caches import (
+    RECIPE_FRAGMENT_STATS, RESPONSE_STATS, STATS_KEY, USERS_VERSION, get_stats,
+    get_version,
+)
+from api.jobs import run_pending_jobs
+from api.models import Ingredient, Recipe, ShopListJob, Subscription, Tag
+from api.serializers import (
+    IngredientSerializer, RecipeReadSerializer, TagSerializer,
+)
+from api.utils import get_shop_list_pdf
+from api.views import RecipeViewSet
 
 User = get_user_model()
 
@@ -16,6 +42,24 @@ USERS_SET_PASSWORD_URL = reverse('users-set-password')
 USERS_ME_URL = reverse('users-me')
 INGREDIENTS_URL = reverse('ingredients-list')
 TAGS_URL = reverse('tags-list')
+RECIPES_URL = reverse('recipes-list')
+RECIPES_DOWNLOAD_SHOPPING_CART = reverse('recipes-download-shopping-cart')
+RECIPES_LIST_QUERIES = 6
+RECIPES_DETAIL_QUERIES = 6
+RECIPES_CREATE_QUERIES = 10
+RECIPES_UPDATE_QUERIES = 18
+RECIPES_WRITE_INGREDIENTS = 30
+RECIPES_WRITE_TAGS = 3
+RECIPES_PAGE_SIZE = 20
+RECIPES_CURSOR_LIMIT = 6
+TAG_SLUG_OTHER = 'other-slug'
+RECIPE_NAME_OTHER = 'OtherRecipeName'
+RECIPES_FRAGMENT_QUERIES = 4
+SUBSCRIPTIONS_QUERIES = 4
+RECIPE_IMAGE_BASE64 = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
 
 
 # Users
@@ -132,7 +176,7 @@ def test_users_set_password(user_client, user_credentials):
 def test_ingredients_list(setup_ingredient, guest_client):
     """Запрос списка ингредиентов возвращает ожидаемые данные."""
     assert 1 == Ingredient.objects.count()
-    assert guest_client.get(INGREDIENTS_URL).data[0]['id'] == (
+    assert guest_client.get(INGREDIENTS_URL).json()[0]['id'] == (
         setup_ingredient.id
     )
 
@@ -155,7 +199,7 @@ def test_ingredients_by_id(setup_ingredient, guest_client):
 def test_tags_list(setup_tag, guest_client):
     """Запрос списка тэгов возвращает ожидаемые данные."""
     assert 1 == Tag.objects.count()
-    assert guest_client.get(TAGS_URL).data[0]['id'] == setup_tag.id
+    assert guest_client.get(TAGS_URL).json()[0]['id'] == setup_tag.id
 
 
 @pytest.mark.django_db
@@ -325,3 +369,737 @@ def test_recipes_shopping_cart_delete_twice(user_client, setup_recipe):
         user_client.delete(RECIPES_SHOPPING_CART).status_code
         == status.HTTP_400_BAD_REQUEST
     )
+
+
+@pytest.mark.parametrize('format, content_type, content', (
+    ('csv', 'text/csv; charset=utf-8',
+     'Название,Единица измерения,Количество\r\n'
+     f'{INGREDIENT_NAME},{INGREDIENT_MU},{INGREDIENT_AMOUNT}\r\n'),
+    ('txt', 'text/plain; charset=utf-8',
+     f'Список покупок для {FIRST_NAME} {LAST_NAME}\n\n'
+     f'{INGREDIENT_NAME.capitalize()} ({INGREDIENT_MU}) - '
+     f'{INGREDIENT_AMOUNT}\n'),
+))
+def test_recipes_download_shopping_cart_stream(user_client_recipe_in_cart,
+                                               format, content_type,
+                                               content):
+    """Список покупок в CSV и TXT отдается потоком без записи на диск."""
+    response = user_client_recipe_in_cart.get(
+        RECIPES_DOWNLOAD_SHOPPING_CART, {'format': format}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response['Content-Type'] == content_type
+    assert response['Content-Disposition'] == (
+        f'attachment; filename="shopping_list.{format}"'
+    )
+    assert b''.join(response.streaming_content).decode() == content
+
+
+def test_recipes_download_shopping_cart_pdf(user_client_recipe_in_cart):
+    """Список покупок в PDF отдается из памяти."""
+    with mock.patch('api.utils.create_shop_list',
+                    return_value=b'%PDF') as create_shop_list:
+        response = user_client_recipe_in_cart.get(
+            RECIPES_DOWNLOAD_SHOPPING_CART
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Type'] == 'application/pdf'
+    assert b''.join(response.streaming_content) == b'%PDF'
+    assert list(create_shop_list.call_args.args[1]) == [
+        (INGREDIENT_NAME, INGREDIENT_MU, INGREDIENT_AMOUNT),
+    ]
+
+
+def test_recipes_download_shopping_cart_unknown_format(user_client):
+    """Неизвестный формат списка покупок отклоняется."""
+    assert user_client.get(
+        RECIPES_DOWNLOAD_SHOPPING_CART, {'format': 'docx'}
+    ).status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_recipes_download_shopping_cart_job(user_client_recipe_in_cart):
+    """Список покупок рендерится фоновой задачей и отдается по готовности."""
+    job_id = user_client_recipe_in_cart.post(
+        RECIPES_DOWNLOAD_SHOPPING_CART
+    ).data['id']
+    RECIPES_DOWNLOAD_SHOPPING_CART_JOB = reverse(
+        'recipes-download-shopping-cart-job', args=[job_id]
+    )
+    response = user_client_recipe_in_cart.get(
+        RECIPES_DOWNLOAD_SHOPPING_CART_JOB
+    )
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data['status'] == ShopListJob.Status.PENDING
+    with mock.patch('api.utils.create_shop_list', return_value=b'%PDF'):
+        assert run_pending_jobs() == 1
+    assert run_pending_jobs() == 0
+    response = user_client_recipe_in_cart.get(
+        RECIPES_DOWNLOAD_SHOPPING_CART_JOB
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Type'] == 'application/pdf'
+    assert b''.join(response.streaming_content) == b'%PDF'
+
+
+@pytest.mark.parametrize('shared, rendered', (
+    (True, b'%CACHED'), (False, b'%PDF'),
+))
+def test_recipes_download_shopping_cart_job_shared_cache(
+    user_client_recipe_in_cart, setup_user, settings, shared, rendered
+):
+    """Без общего кэша воркер рендерит список покупок из базы."""
+    settings.SHARED_CACHE = shared
+    job_id = user_client_recipe_in_cart.post(
+        RECIPES_DOWNLOAD_SHOPPING_CART
+    ).data['id']
+    with mock.patch('api.utils.create_shop_list', return_value=b'%CACHED'):
+        get_shop_list_pdf(setup_user)
+    with mock.patch('api.utils.create_shop_list', return_value=b'%PDF'):
+        run_pending_jobs()
+    assert ShopListJob.objects.get(id=job_id).result == rendered
+
+
+def test_recipes_download_shopping_cart_job_failed(user_client):
+    """Ошибка рендера помечает задачу как неудачную."""
+    job_id = user_client.post(RECIPES_DOWNLOAD_SHOPPING_CART).data['id']
+    with mock.patch('api.utils.create_shop_list', side_effect=RuntimeError):
+        run_pending_jobs()
+    response = user_client.get(
+        reverse('recipes-download-shopping-cart-job', args=[job_id])
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['status'] == ShopListJob.Status.FAILED
+
+
+def test_recipes_download_shopping_cart_job_other_user(user_client,
+                                                       user_client_other):
+    """Чужая задача на список покупок недоступна."""
+    job_id = user_client.post(RECIPES_DOWNLOAD_SHOPPING_CART).data['id']
+    assert user_client_other.get(
+        reverse('recipes-download-shopping-cart-job', args=[job_id])
+    ).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize('params, found', (
+    ({}, True),
+    ({'is_favorited': 'true'}, True),
+    ({'is_favorited': 'false'}, False),
+    ({'is_in_shopping_cart': 'true'}, False),
+    ({'is_in_shopping_cart': 'false'}, True),
+))
+def test_recipes_filter_user_relations(user_client_recipe_in_favorite,
+                                       setup_recipe, params, found):
+    """Фильтры по избранному и корзине отбирают рецепты пользователя."""
+    results = user_client_recipe_in_favorite.get(RECIPES_URL,
+                                                 params).data['results']
+    assert [recipe['id'] for recipe in results] == (
+        [setup_recipe.id] if found else []
+    )
+    if found:
+        assert results[0]['is_favorited'] is True
+        assert results[0]['is_in_shopping_cart'] is False
+
+
+@pytest.mark.parametrize('params', (
+    {}, {'is_favorited': 'true'}, {'is_in_shopping_cart': 'false'},
+))
+def test_recipes_list_without_group_by(user_client_recipe_in_favorite,
+                                       params):
+    """Список рецептов выбирается без GROUP BY по таблице рецептов."""
+    with CaptureQueriesContext(connection) as context:
+        user_client_recipe_in_favorite.get(RECIPES_URL, params)
+    recipe_queries = [query['sql'] for query in context.captured_queries
+                      if query['sql'].startswith('SELECT')
+                      and 'FROM "api_recipe"' in query['sql']]
+    assert recipe_queries
+    with connection.cursor() as cursor:
+        for sql in recipe_queries:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+            assert 'GROUP BY' not in plan
+            assert 'GROUP BY' not in sql
+
+
+@pytest.fixture()
+def setup_recipes_page(setup_recipe, setup_user_other, setup_ingredient,
+                       setup_tag, setup_subscription):
+    for number in range(RECIPES_PAGE_SIZE - 1):
+        ingredient = Ingredient.objects.create(
+            name=f'{number}{INGREDIENT_NAME}',
+            measurement_unit=INGREDIENT_MU,
+        )
+        recipe = Recipe.objects.create(
+            author=setup_user_other if number % 2 else setup_recipe.author,
+            name=f'{number}{RECIPE_NAME}',
+            image=f'{number}{RECIPE_IMAGE}',
+            text=RECIPE_TEXT,
+            cooking_time=RECIPE_COOKING_TIME,
+        )
+        recipe.tags.add(setup_tag)
+        recipe.ingredients.add(setup_ingredient, ingredient,
+                               through_defaults={'amount': 1})
+    return Recipe.objects.all()
+
+
+@pytest.mark.parametrize('client_name', ('guest_client', 'user_client_other'))
+def test_recipes_list_query_budget(request, setup_recipes_page,
+                                   django_assert_max_num_queries,
+                                   client_name):
+    """Список рецептов выбирается за постоянное число запросов."""
+    client = request.getfixturevalue(client_name)
+    with django_assert_max_num_queries(RECIPES_LIST_QUERIES):
+        results = client.get(
+            RECIPES_URL, {'limit': RECIPES_PAGE_SIZE}
+        ).data['results']
+    assert len(results) == RECIPES_PAGE_SIZE
+    for recipe in results:
+        assert recipe['tags'][0]['slug'] == TAG_SLUG
+        assert INGREDIENT_NAME in recipe['ingredients'][0]['name']
+        assert recipe['author']['is_subscribed'] is (
+            client_name == 'user_client_other'
+            and recipe['author']['username'] == USERNAME
+        )
+
+
+def test_recipes_detail_query_budget(user_client_other, setup_recipe,
+                                     setup_subscription,
+                                     django_assert_max_num_queries):
+    """Рецепт выбирается за постоянное число запросов."""
+    with django_assert_max_num_queries(RECIPES_DETAIL_QUERIES):
+        response = user_client_other.get(
+            reverse('recipes-detail', args=[setup_recipe.id])
+        )
+    assert response.data['author']['is_subscribed'] is True
+    assert response.data['ingredients'][0]['name'] == INGREDIENT_NAME
+
+
+@pytest.mark.parametrize('client', ('guest_client', 'user_client'))
+def test_recipes_detail_malformed_pk(request, client):
+    """Рецепт с нечисловым идентификатором не найден."""
+    assert request.getfixturevalue(client).get(
+        reverse('recipes-detail', args=['abc'])
+    ).status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_recipes_create_query_budget(user_client, setup_ingredient, setup_tag,
+                                     settings, tmp_path,
+                                     django_assert_max_num_queries):
+    """Рецепт создаётся и возвращается за ограниченное число запросов."""
+    settings.MEDIA_ROOT = tmp_path
+    with django_assert_max_num_queries(RECIPES_CREATE_QUERIES):
+        response = user_client.post(RECIPES_URL, {
+            'ingredients': [{'id': setup_ingredient.id,
+                             'amount': INGREDIENT_AMOUNT}],
+            'tags': [setup_tag.id],
+            'image': RECIPE_IMAGE_BASE64,
+            'name': RECIPE_NAME,
+            'text': RECIPE_TEXT,
+            'cooking_time': RECIPE_COOKING_TIME,
+        }, format='json')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data['author']['is_subscribed'] is False
+    assert response.data['ingredients'][0]['amount'] == INGREDIENT_AMOUNT
+
+
+@pytest.fixture
+def setup_ingredients_many(db):
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'{INGREDIENT_NAME} {number}',
+                   measurement_unit=INGREDIENT_MU)
+        for number in range(RECIPES_WRITE_INGREDIENTS)
+    )
+    return list(Ingredient.objects.all())
+
+
+@pytest.fixture
+def setup_tags_many(db):
+    Tag.objects.bulk_create(
+        Tag(name=f'{TAG_SLUG}-{number}', color=number,
+            slug=f'{TAG_SLUG}-{number}')
+        for number in range(RECIPES_WRITE_TAGS)
+    )
+    return list(Tag.objects.all())
+
+
+def recipe_payload(ingredients, tags, amount=INGREDIENT_AMOUNT):
+    return {
+        'ingredients': [{'id': ingredient.id, 'amount': amount}
+                        for ingredient in ingredients],
+        'tags': [tag.id for tag in tags],
+        'image': RECIPE_IMAGE_BASE64,
+        'name': RECIPE_NAME,
+        'text': RECIPE_TEXT,
+        'cooking_time': RECIPE_COOKING_TIME,
+    }
+
+
+def test_recipes_write_query_budget(user_client, setup_ingredients_many,
+                                    setup_tags_many, settings, tmp_path,
+                                    django_assert_max_num_queries):
+    """Запись рецепта не зависит от числа ингредиентов и тегов."""
+    settings.MEDIA_ROOT = tmp_path
+    ingredients, tags = setup_ingredients_many, setup_tags_many
+    with django_assert_max_num_queries(RECIPES_CREATE_QUERIES):
+        response = user_client.post(RECIPES_URL,
+                                    recipe_payload(ingredients[:-1], tags),
+                                    format='json')
+    assert response.status_code == status.HTTP_201_CREATED
+    recipe = Recipe.objects.get(id=response.data['id'])
+    kept = recipe.ingredientinrecipe_set.get(ingredient=ingredients[1])
+    payload = recipe_payload(ingredients[1:], tags[1:])
+    payload['ingredients'][1]['amount'] += 1
+    with django_assert_max_num_queries(RECIPES_UPDATE_QUERIES) as one_removed:
+        response = user_client.patch(
+            reverse('recipes-detail', args=[recipe.id]), payload,
+            format='json'
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert recipe.ingredientinrecipe_set.get(
+        ingredient=ingredients[1]
+    ).id == kept.id
+    payload = recipe_payload([ingredients[0], ingredients[-1]], tags[2:])
+    payload['ingredients'][1]['amount'] += 1
+    with django_assert_max_num_queries(len(one_removed)):
+        response = user_client.patch(
+            reverse('recipes-detail', args=[recipe.id]), payload,
+            format='json'
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert dict(recipe.ingredientinrecipe_set.values_list(
+        'ingredient', 'amount'
+    )) == {item['id']: item['amount'] for item in payload['ingredients']}
+    assert set(recipe.tags.values_list('id', flat=True)) == set(
+        payload['tags']
+    )
+    assert sorted(item['id'] for item in response.data['ingredients']) == (
+        sorted(item['id'] for item in payload['ingredients'])
+    )
+
+
+def read_recipe(recipe_id, user):
+    """Response of the recipe as the former re-query after writes built it"""
+    view = RecipeViewSet()
+    view.request = SimpleNamespace(user=user)
+    return JSONRenderer().render(RecipeReadSerializer(
+        view.get_queryset().get(id=recipe_id)
+    ).data)
+
+
+def test_recipes_write_response(user_client_recipe_in_favorite,
+                                setup_user, setup_recipe,
+                                setup_ingredients_many, setup_tags_many,
+                                settings, tmp_path):
+    """Ответ на запись рецепта совпадает с повторным чтением рецепта."""
+    settings.MEDIA_ROOT = tmp_path
+    client = user_client_recipe_in_favorite
+    response = client.post(
+        RECIPES_URL,
+        recipe_payload(setup_ingredients_many[::-1], setup_tags_many[::-1]),
+        format='json',
+    )
+    assert response.content == read_recipe(response.data['id'], setup_user)
+    payload = recipe_payload(setup_ingredients_many[5:], setup_tags_many[1:],
+                             amount=INGREDIENT_AMOUNT + 1)
+    for data in (payload, {'name': RECIPE_NAME_OTHER}):
+        response = client.patch(
+            reverse('recipes-detail', args=[setup_recipe.id]), data,
+            format='json',
+        )
+        assert response.data['is_favorited'] is True
+        assert response.content == read_recipe(setup_recipe.id, setup_user)
+
+
+def test_recipes_write_unknown_ids(user_client, setup_ingredient, setup_tag,
+                                   settings, tmp_path):
+    """Несуществующие ингредиенты и теги отклоняются."""
+    settings.MEDIA_ROOT = tmp_path
+    payload = recipe_payload([setup_ingredient], [setup_tag])
+    payload['ingredients'].append({'id': setup_ingredient.id + 1,
+                                   'amount': 1})
+    payload['tags'].append(str(setup_tag.id + 1))
+    response = user_client.post(RECIPES_URL, payload, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert 'tags' in response.data
+    assert 'ingredients_1_id' in response.data
+    assert not Recipe.objects.exists()
+
+
+def test_recipes_cursor_pagination(guest_client, setup_recipes_page):
+    """Курсорная пагинация проходит ленту рецептов в обе стороны."""
+    expected = list(setup_recipes_page.order_by('-pub_date', '-id')
+                    .values_list('id', flat=True))
+    pages = []
+    url = RECIPES_URL
+    params = {'cursor': '', 'limit': RECIPES_CURSOR_LIMIT}
+    while url:
+        with CaptureQueriesContext(connection) as context:
+            data = guest_client.get(url, params).data
+        assert 'count' not in data
+        assert not any('COUNT(' in query['sql']
+                       for query in context.captured_queries)
+        pages.append([recipe['id'] for recipe in data['results']])
+        url, params = data['next'], None
+    assert sum(pages, []) == expected
+    assert len(pages[-1]) == len(expected) % RECIPES_CURSOR_LIMIT
+    previous = []
+    url = data['previous']
+    while url:
+        data = guest_client.get(url).data
+        previous.insert(0, [recipe['id'] for recipe in data['results']])
+        url = data['previous']
+    assert previous == pages[:-1]
+
+
+def test_recipes_cursor_pagination_invalid(guest_client):
+    """Неверный курсор приводит к ошибке 404."""
+    assert guest_client.get(
+        RECIPES_URL, {'cursor': 'invalid'}
+    ).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize('position', (
+    ['garbage', 'x'], ['2021-09-01 00:00:00+00:00', 'x'], [[], {}],
+))
+def test_recipes_cursor_pagination_tampered(guest_client, position):
+    """Курсор с неверными значениями полей приводит к ошибке 404."""
+    cursor = base64.urlsafe_b64encode(
+        json.dumps({'p': position, 'r': False}).encode()
+    ).decode()
+    assert guest_client.get(
+        RECIPES_URL, {'cursor': cursor}
+    ).status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_subscriptions_cursor_pagination(user_client_other, setup_recipe,
+                                         setup_subscription):
+    """Подписки пользователя доступны с курсорной пагинацией."""
+    data = user_client_other.get(
+        reverse('users-subscriptions'), {'cursor': ''}
+    ).data
+    assert [user['username'] for user in data['results']] == [USERNAME]
+    assert data['next'] is None
+    assert data['previous'] is None
+
+
+@pytest.mark.parametrize('tags, found', (
+    ((TAG_SLUG,), 1),
+    ((TAG_SLUG, TAG_SLUG_OTHER), 2),
+    ((TAG_SLUG_OTHER,), 2),
+))
+def test_recipes_filter_tags(guest_client, setup_recipe, setup_user,
+                             setup_tag, tags, found):
+    """Фильтр по тегам отбирает рецепты без повторов и без DISTINCT."""
+    tag_other = Tag.objects.create(name=TAG_SLUG_OTHER, color=0,
+                                   slug=TAG_SLUG_OTHER)
+    setup_recipe.tags.add(tag_other)
+    recipe_other = Recipe.objects.create(author=setup_user,
+                                         name=RECIPE_NAME,
+                                         image=f'other{RECIPE_IMAGE}',
+                                         text=RECIPE_TEXT,
+                                         cooking_time=RECIPE_COOKING_TIME)
+    recipe_other.tags.add(tag_other)
+    with CaptureQueriesContext(connection) as context:
+        data = guest_client.get(RECIPES_URL, {'tags': tags}).data
+    assert data['count'] == found
+    assert len({recipe['id'] for recipe in data['results']}) == found
+    assert not any('DISTINCT' in query['sql']
+                   for query in context.captured_queries)
+
+
+def test_recipes_anonymous_response_cached(guest_client, setup_recipe,
+                                           django_assert_num_queries):
+    """Ответ анонимному пользователю повторно отдается из кэша."""
+    detail_url = reverse('recipes-detail', args=[setup_recipe.id])
+    data = guest_client.get(RECIPES_URL, {'tags': TAG_SLUG}).data
+    detail = guest_client.get(detail_url).data
+    with django_assert_num_queries(0):
+        assert guest_client.get(
+            RECIPES_URL, {'tags': TAG_SLUG}
+        ).data == data
+    with django_assert_num_queries(1):
+        assert guest_client.get(detail_url).data == detail
+    assert get_stats(RESPONSE_STATS) == {'hits': 2, 'misses': 2,
+                                         'hit_rate': 0.5}
+
+
+def test_recipes_anonymous_response_normalized_query(
+        guest_client, setup_recipe, django_assert_num_queries):
+    """Порядок параметров запроса не влияет на ключ кэша."""
+    Tag.objects.create(name=TAG_SLUG_OTHER, color=0, slug=TAG_SLUG_OTHER)
+    guest_client.get(
+        f'{RECIPES_URL}?tags={TAG_SLUG}&tags={TAG_SLUG_OTHER}&limit=1'
+    )
+    with django_assert_num_queries(0):
+        guest_client.get(
+            f'{RECIPES_URL}?limit=1&tags={TAG_SLUG_OTHER}&tags={TAG_SLUG}'
+        )
+
+
+def test_recipes_authenticated_response_not_cached(user_client,
+                                                   setup_recipe):
+    """Ответы пользователям с учётной записью не кэшируются."""
+    user_client.get(RECIPES_URL)
+    with CaptureQueriesContext(connection) as context:
+        user_client.get(RECIPES_URL)
+    assert context.captured_queries
+
+
+def rename_recipe(recipe):
+    recipe.name = RECIPE_NAME_OTHER
+    recipe.save()
+
+
+def rename_tag(recipe):
+    tag = recipe.tags.get()
+    tag.name = RECIPE_NAME_OTHER
+    tag.save()
+
+
+def rename_ingredient(recipe):
+    ingredient = recipe.ingredients.get()
+    ingredient.name = RECIPE_NAME_OTHER
+    ingredient.save()
+
+
+def rename_author(recipe):
+    recipe.author.first_name = RECIPE_NAME_OTHER
+    recipe.author.save(update_fields=('first_name',))
+
+
+@pytest.mark.parametrize('change, field', (
+    (rename_recipe, 'name'),
+    (rename_tag, 'tags'),
+    (rename_ingredient, 'ingredients'),
+    (rename_author, 'author'),
+))
+def test_recipes_anonymous_response_invalidated(
+    guest_client, setup_recipe, change, field,
+    django_capture_on_commit_callbacks,
+):
+    """Кэш ответов сбрасывается при изменении данных рецепта."""
+    url = reverse('recipes-detail', args=[setup_recipe.id])
+    before = guest_client.get(url).data
+    with django_capture_on_commit_callbacks(execute=True):
+        change(setup_recipe)
+    after = guest_client.get(url).data
+    assert after[field] != before[field]
+    assert RECIPE_NAME_OTHER in str(after[field])
+
+
+def test_users_version_kept_on_password_change(
+    user_client, setup_user, django_capture_on_commit_callbacks,
+):
+    """Смена пароля не сбрасывает кэш ответов с данными пользователей."""
+    version = get_version(USERS_VERSION)
+    with django_capture_on_commit_callbacks(execute=True):
+        assert user_client.post(reverse('users-set-password'), {
+            'current_password': PASSWORD,
+            'new_password': PASSWORD_OTHER,
+        }, format='json').status_code == status.HTTP_204_NO_CONTENT
+    assert get_version(USERS_VERSION) == version
+    setup_user.first_name = RECIPE_NAME_OTHER
+    with django_capture_on_commit_callbacks(execute=True):
+        setup_user.save()
+    assert get_version(USERS_VERSION) != version
+
+
+def test_recipes_anonymous_response_kept_on_login(guest_client, setup_recipe,
+                                                  user_credentials,
+                                                  django_assert_num_queries):
+    """Вход пользователя не сбрасывает кэш ответов."""
+    guest_client.get(RECIPES_URL)
+    guest_client.post(TOKEN_LOGIN_URL, {
+        'email': user_credentials['email'],
+        'password': user_credentials['password'],
+    })
+    guest_client.credentials()
+    with django_assert_num_queries(0):
+        guest_client.get(RECIPES_URL)
+
+
+@pytest.mark.parametrize('url, create', (
+    (TAGS_URL, lambda: Tag.objects.create(name=TAG_SLUG_OTHER, color=0,
+                                          slug=TAG_SLUG_OTHER)),
+    (INGREDIENTS_URL, lambda: Ingredient.objects.create(
+        name=INGREDIENT_NAME, measurement_unit=RECIPE_NAME_OTHER
+    )),
+))
+def test_reference_anonymous_response_invalidated(
+    guest_client, setup_tag, setup_ingredient, url, create,
+    django_capture_on_commit_callbacks,
+):
+    """Кэш тегов и ингредиентов сбрасывается при их изменении."""
+    assert len(guest_client.get(url).json()) == 1
+    with django_capture_on_commit_callbacks(execute=True):
+        create()
+    assert len(guest_client.get(url).json()) == 2
+
+
+@pytest.mark.parametrize('url, serializer_class, queryset', (
+    (TAGS_URL, TagSerializer, Tag.objects.all),
+    (INGREDIENTS_URL, IngredientSerializer, Ingredient.objects.all),
+))
+def test_reference_snapshot(guest_client, user_client, setup_tag,
+                            setup_ingredient, url, serializer_class,
+                            queryset, django_assert_num_queries):
+    """Полный список тегов и ингредиентов отдается готовым JSON."""
+    response = guest_client.get(url)
+    assert response.content == JSONRenderer().render(
+        serializer_class(queryset(), many=True).data
+    )
+    assert 'max-age' in response['Cache-Control']
+    with django_assert_num_queries(0):
+        assert guest_client.get(url).content == response.content
+    assert user_client.get(url)['ETag'] == response['ETag']
+
+
+def test_recipes_fragments_cached(user_client, user_client_other,
+                                  setup_recipes_page, setup_recipe,
+                                  django_assert_max_num_queries):
+    """Рецепты берутся из кэша, флаги пользователя вычисляются заново."""
+    setup_recipe.author.favorite_recipes.add(setup_recipe)
+    params = {'limit': RECIPES_PAGE_SIZE}
+    cold = user_client_other.get(RECIPES_URL, params).json()
+    with django_assert_max_num_queries(RECIPES_FRAGMENT_QUERIES):
+        warm = user_client_other.get(RECIPES_URL, params).json()
+    assert warm == cold
+    own = user_client.get(RECIPES_URL, params).json()
+    assert get_stats(RECIPE_FRAGMENT_STATS) == {
+        'hits': 2 * RECIPES_PAGE_SIZE,
+        'misses': RECIPES_PAGE_SIZE,
+        'hit_rate': 0.667,
+    }
+    for recipe, recipe_own in zip(cold['results'], own['results']):
+        assert recipe['author']['is_subscribed'] is (
+            recipe['author']['username'] == USERNAME
+        )
+        assert recipe_own['author']['is_subscribed'] is False
+        assert recipe['is_favorited'] is False
+        assert recipe_own['is_favorited'] is (recipe['id'] == setup_recipe.id)
+        assert {**recipe_own, 'author': None, 'is_favorited': None} == {
+            **recipe, 'author': None, 'is_favorited': None,
+        }
+
+
+@pytest.mark.parametrize('change, field, misses', (
+    (rename_recipe, 'name', 1),
+    (rename_author, 'author', RECIPES_PAGE_SIZE // 2 + 1),
+    (rename_tag, 'tags', RECIPES_PAGE_SIZE),
+))
+def test_recipes_fragments_invalidated(user_client, setup_recipes_page,
+                                       setup_recipe, change, field, misses,
+                                       django_capture_on_commit_callbacks):
+    """Изменение рецепта сбрасывает только зависящие от него фрагменты."""
+    params = {'limit': RECIPES_PAGE_SIZE}
+    user_client.get(RECIPES_URL, params)
+    with django_capture_on_commit_callbacks(execute=True):
+        change(setup_recipe)
+    cache.delete(STATS_KEY.format(name=RECIPE_FRAGMENT_STATS,
+                                  event='misses'))
+    results = user_client.get(RECIPES_URL, params).data['results']
+    assert get_stats(RECIPE_FRAGMENT_STATS)['misses'] == misses
+    recipe = next(recipe for recipe in results
+                  if recipe['id'] == setup_recipe.id)
+    assert RECIPE_NAME_OTHER in str(recipe[field])
+    assert user_client.get(
+        reverse('recipes-detail', args=[setup_recipe.id])
+    ).data == recipe
+
+
+@pytest.mark.parametrize('url', (RECIPES_URL, TAGS_URL, INGREDIENTS_URL))
+def test_conditional_get_not_modified(guest_client, setup_recipe, url,
+                                      django_assert_num_queries):
+    """Совпадающий ETag дает ответ 304 без запросов к базе данных."""
+    response = guest_client.get(url)
+    assert response['Last-Modified']
+    with django_assert_num_queries(0):
+        not_modified = guest_client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not_modified['ETag'] == response['ETag']
+    assert not not_modified.content
+    assert guest_client.get(
+        url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+    ).status_code == status.HTTP_304_NOT_MODIFIED
+
+
+def test_conditional_get_recipe_changed(guest_client, setup_recipe,
+                                        django_capture_on_commit_callbacks):
+    """ETag рецепта меняется вместе с рецептом."""
+    url = reverse('recipes-detail', args=[setup_recipe.id])
+    etag = guest_client.get(url)['ETag']
+    with django_capture_on_commit_callbacks(execute=True):
+        rename_recipe(setup_recipe)
+    response = guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['name'] == RECIPE_NAME_OTHER
+    assert 'modified' not in response.data
+    assert response['ETag'] != etag
+
+
+def test_conditional_get_user_flags(user_client, user_client_other,
+                                    setup_user, setup_recipe,
+                                    django_capture_on_commit_callbacks):
+    """ETag зависит от избранного, корзины и подписок пользователя."""
+    etag = user_client.get(RECIPES_URL)['ETag']
+    etag_other = user_client_other.get(RECIPES_URL)['ETag']
+    assert etag != etag_other
+    with django_capture_on_commit_callbacks(execute=True):
+        setup_user.favorite_recipes.add(setup_recipe)
+    response = user_client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['results'][0]['is_favorited'] is True
+    assert user_client_other.get(
+        RECIPES_URL, HTTP_IF_NONE_MATCH=etag_other
+    ).status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.parametrize('authors', (1, 5))
+@pytest.mark.parametrize('recipes_limit, shown', (
+    (None, 3), ('2', 2), ('0', 0), ('-1', 3), ('5', 3),
+))
+def test_subscriptions_recipes(user_client, setup_user,
+                               django_user_model,
+                               django_assert_max_num_queries,
+                               authors, recipes_limit, shown):
+    """Рецепты авторов в подписках выбираются постоянным числом запросов."""
+    latest = {}
+    for number in range(authors):
+        author = django_user_model.objects.create_user(
+            email=f'{number}{EMAIL_OTHER}',
+            username=f'{number}{USERNAME_OTHER}',
+            password=PASSWORD_OTHER,
+        )
+        Subscription.objects.create(author=author, subscriber=setup_user)
+        latest[author.username] = [
+            Recipe.objects.create(author=author,
+                                  name=f'{recipe}{RECIPE_NAME}',
+                                  image=f'{number}{recipe}{RECIPE_IMAGE}',
+                                  text=RECIPE_TEXT,
+                                  cooking_time=RECIPE_COOKING_TIME).id
+            for recipe in range(3)
+        ][::-1]
+    params = {'limit': authors}
+    if recipes_limit is not None:
+        params['recipes_limit'] = recipes_limit
+    with django_assert_max_num_queries(SUBSCRIPTIONS_QUERIES):
+        results = user_client.get(reverse('users-subscriptions'),
+                                  params).data['results']
+    assert len(results) == authors
+    for author in results:
+        assert author['is_subscribed'] is True
+        assert author['recipe_count'] == shown
+        assert [recipe['id'] for recipe in author['recipes']] == (
+            latest[author['username']][:shown]
+        )
+
+
+def test_deploy_requires_shared_cache(settings):
+    """Проверка перед развертыванием требует общий кэш."""
+    settings.SHARED_CACHE = False
+    with pytest.raises(SystemCheckError, match='api.E001'):
+        call_command('check', '--deploy', '--tag', 'caches')
+    settings.SHARED_CACHE = True
+    call_command('check', '--deploy', '--tag', 'caches')
@@ -0,0 +1,203 @@
+"""
+Recipes export and import as NDJSON, one recipe per line. Both sides work
+by chunks, so memory does not grow with the number of recipes.
+"""
+import base64
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_datetime
+
+from .caches import RECIPES_VERSION, USERS_VERSION, bump_version
+from .counters import recompute_counters
+from .models import Ingredient, IngredientInRecipe, Recipe, Tag
+
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+User = get_user_model()
+
+
+def read_image(image):
+    try:
+        with image.open('rb') as file:
+            return base64.b64encode(file.read()).decode()
+    except (OSError, ValueError):
+        return None
+
+
+def dump_recipe(recipe, images=True):
+    record = {
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'pub_date': recipe.pub_date.isoformat(),
+        'author': {field: getattr(recipe.author, field)
+                   for field in AUTHOR_FIELDS},
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': amount.ingredient.name,
+                'measurement_unit': amount.ingredient.measurement_unit,
+                'amount': amount.amount,
+            }
+            for amount in recipe.ingredientinrecipe_set.all()
+        ],
+        'image': recipe.image.name,
+    }
+    image_data = images and read_image(recipe.image)
+    if image_data:
+        record['image_data'] = image_data
+    return record
+
+
+def export_recipes(images=True, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield NDJSON lines of recipes, reading them by chunks of ids"""
+    queryset = Recipe.objects.order_by('id').select_related(
+        'author'
+    ).prefetch_related(
+        'tags',
+        Prefetch('ingredientinrecipe_set',
+                 IngredientInRecipe.objects.select_related('ingredient')),
+    )
+    last_id = 0
+    while True:
+        recipes = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not recipes:
+            return
+        for recipe in recipes:
+            yield json.dumps(dump_recipe(recipe, images), ensure_ascii=False)
+        last_id = recipes[-1].id
+
+
+def get_authors(records):
+    """Map emails of authors to ids, creating missing authors"""
+    authors = {record['author']['email']: record['author']
+               for record in records}
+    ids = dict(User.objects.filter(
+        email__in=authors
+    ).values_list('email', 'id'))
+    missing = [author for email, author in authors.items()
+               if email not in ids]
+    if missing:
+        User.objects.bulk_create(
+            [User(password=make_password(None),
+                  **{field: author[field] for field in AUTHOR_FIELDS})
+             for author in missing],
+            ignore_conflicts=True,
+        )
+        ids.update(User.objects.filter(
+            email__in=[author['email'] for author in missing]
+        ).values_list('email', 'id'))
+    return ids
+
+
+def save_image(record):
+    """Save the image sent in the record unless the storage has it"""
+    name = record['image']
+    if 'image_data' in record and not default_storage.exists(name):
+        name = default_storage.save(
+            name, ContentFile(base64.b64decode(record['image_data']))
+        )
+    return name
+
+
+def get_key(record):
+    return record['author']['email'], record['name'], record['image']
+
+
+def import_chunk(records, tags, ingredients):
+    """
+    Create recipes of the chunk, return the number of created ones.
+    Recipes may share an image, so a recipe is told by its author, name
+    and image
+    """
+    existing = set(Recipe.objects.filter(
+        image__in=[record['image'] for record in records]
+    ).values_list('author__email', 'name', 'image'))
+    new_records = []
+    for record in records:
+        if get_key(record) in existing or not (
+            all(slug in tags for slug in record['tags'])
+            and all((item['name'], item['measurement_unit']) in ingredients
+                    for item in record['ingredients'])
+        ):
+            continue
+        existing.add(get_key(record))
+        new_records.append(record)
+    records = new_records
+    authors = get_authors(records)
+    records = [record for record in records
+               if record['author']['email'] in authors]
+    recipes = []
+    for record in records:
+        record['image'] = save_image(record)
+        recipes.append(Recipe(
+            author_id=authors[record['author']['email']],
+            name=record['name'],
+            image=record['image'],
+            text=record['text'],
+            cooking_time=record['cooking_time'],
+        ))
+    Recipe.objects.bulk_create(recipes)
+    emails = {author_id: email for email, author_id in authors.items()}
+    ids = {
+        (emails[author_id], name, image): recipe_id
+        for recipe_id, author_id, name, image in Recipe.objects.filter(
+            image__in=[record['image'] for record in records],
+            author_id__in=emails,
+        ).values_list('id', 'author_id', 'name', 'image')
+    }
+    for recipe, record in zip(recipes, records):
+        recipe.pk = ids[get_key(record)]
+        recipe.pub_date = parse_datetime(record['pub_date'])
+    Recipe.objects.bulk_update(recipes, ('pub_date',))
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe.pk, tag_id=tags[slug])
+        for recipe, record in zip(recipes, records)
+        for slug in record['tags']
+    )
+    IngredientInRecipe.objects.bulk_create(
+        IngredientInRecipe(
+            recipe_id=recipe.pk,
+            ingredient_id=ingredients[(item['name'],
+                                       item['measurement_unit'])],
+            amount=item['amount'],
+        )
+        for recipe, record in zip(recipes, records)
+        for item in record['ingredients']
+    )
+    return len(recipes)
+
+
+def import_recipes(lines, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create recipes from NDJSON lines, each chunk in its own transaction.
+    Recipes already in the database are skipped, so the import can be
+    rerun. Yield numbers of created and skipped recipes by chunks
+    """
+    tags = dict(Tag.objects.values_list('slug', 'id'))
+    ingredients = {
+        (name, unit): ingredient_id
+        for ingredient_id, name, unit in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        )
+    }
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, batch_size))
+        if not chunk:
+            break
+        records = [json.loads(line) for line in chunk if line.strip()]
+        with transaction.atomic():
+            created = import_chunk(records, tags, ingredients)
+        yield created, len(records) - created
+    list(recompute_counters())
+    bump_version(RECIPES_VERSION, USERS_VERSION)
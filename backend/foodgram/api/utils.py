@@ -1,4 +1,24 @@
-from fpdf import FPDF
+import csv
+import logging
+import string
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import lru_cache
+from types import SimpleNamespace
+
+import fpdf.fpdf
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from fpdf import FPDF, set_global
+from fpdf.ttfonts import TTFontFile
+
+from .caches import (
+    INGREDIENTS_VERSION, SHOP_LIST_STATS, get_cart_version, get_version,
+    record,
+)
+from .models import IngredientInRecipe, Recipe
+from .replicas import primary_reads
 
 PDF_INGREDIENT_LINE = '{name} ({unit}) - {amount}'
 PDF_HEAD_LINE = 'Список покупок для {name} {surname}'
@@ -12,34 +32,273 @@ PDF_FONT_NAME = 'DejaVuSansCondensed.ttf'
 PDF_FONT_SIZE = 14
 PDF_LINE_BRAKE_BIG = PDF_CELL_HEGHT * 2
 PDF_LINE_BRAKE_SMALL = PDF_CELL_HEGHT
+PDF_FONT_CACHE_MODE_NONE = 1
+PDF_FONT_CONTROL_CHARS = range(32)
+PDF_FONT_CHARSET = (string.printable.strip()
+                    + ' «»'
+                    + 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ'
+                    + 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя')
+PDF_FONT_SUBSETS_LIMIT = 64
+PDF_PRELOAD_USER = SimpleNamespace(first_name='', last_name='')
+PDF_OUTPUT_STRING = 'S'
+PDF_OUTPUT_ENCODING = 'latin-1'
+CSV_HEADER = ('Название', 'Единица измерения', 'Количество')
+TXT_LINE = '{line}\n'
+SHOP_LIST_CACHE_KEY = 'shop_list:{user}:{cart}:{ingredients}'
+SHOP_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+LATEST_RECIPES_FIELDS = ('id', 'author_id', 'name', 'image', 'renditions',
+                         'cooking_time')
+LATEST_RECIPES_SQL = (
+    'SELECT {fields} FROM ('
+    'SELECT {fields}, ROW_NUMBER() OVER ('
+    'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+    ') AS position FROM {table} WHERE author_id IN ({authors})'
+    ') AS ranked {limit}ORDER BY author_id, position'
+)
+LATEST_RECIPES_LIMIT = 'WHERE position <= %s '
+
+logger = logging.getLogger(__name__)
+
+# Subset cache of the document whose fonts are being embedded
+font_subsets = ContextVar('font_subsets', default=None)
+
 
+def set_prefetched(instance, relation, objects):
+    """
+    Put objects already in memory to the cache of the relation, the same
+    way prefetch_related does, so reading the relation makes no query
+    """
+    queryset = getattr(instance, relation).none()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[relation] = queryset
 
-def create_shop_list(pdf_name, user, ingredients):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.add_font(PDF_FONT_FAMILY,
-                 PDF_FONT_STYLE,
-                 PDF_FONT_NAME,
-                 uni=True)
-    pdf.set_font(PDF_FONT_FAMILY, size=PDF_FONT_SIZE)
-    pdf.cell(
-        PDF_CELL_WIDTH,
-        PDF_CELL_HEGHT,
-        txt=PDF_HEAD_LINE.format(name=user.first_name,
-                                 surname=user.last_name),
-        align=PDF_ALIGN_CENTER
+
+def get_latest_recipes(author_ids, limit=None):
+    """
+    Select up to `limit` latest recipes of every author in one query
+    numbering recipes inside each author, return them by author ids
+    """
+    recipes = defaultdict(list)
+    if not author_ids:
+        return recipes
+    params = list(author_ids)
+    if limit is not None:
+        params.append(limit)
+    for recipe in Recipe.objects.raw(LATEST_RECIPES_SQL.format(
+        fields=', '.join(connection.ops.quote_name(field)
+                         for field in LATEST_RECIPES_FIELDS),
+        table=connection.ops.quote_name(Recipe._meta.db_table),
+        authors=', '.join(['%s'] * len(author_ids)),
+        limit=LATEST_RECIPES_LIMIT if limit is not None else '',
+    ), params):
+        recipes[recipe.author_id].append(recipe)
+    return recipes
+
+
+def aggregate_shop_list(user):
+    """
+    Sum up ingredient amounts over all recipes in user's shopping cart
+    with a single GROUP BY query, yield (name, unit, amount) rows
+    """
+    return (
+        IngredientInRecipe.objects
+        .filter(recipe__users_have_in_shopping_cart=user)
+        .values_list('ingredient__name', 'ingredient__measurement_unit')
+        .annotate(amount=Sum('amount'))
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+        .iterator()
     )
-    pdf.ln(PDF_LINE_BRAKE_BIG)
-    for name, unit, amount in ((name, unit, ingredients[name, unit])
-                               for name, unit in ingredients):
+
+
+class EchoBuffer:
+    """File-like object returning written value instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+class FontSubset(list):
+    """
+    Codes of characters embedded into a document without repeats and with
+    constant time lookups, fpdf checks membership for every font glyph
+    """
+
+    def __init__(self, codes):
+        super().__init__(dict.fromkeys(codes))
+        self.codes = set(self)
+
+    def __contains__(self, code):
+        return code in self.codes
+
+    def __delitem__(self, index):
+        self.codes.discard(self[index])
+        super().__delitem__(index)
+
+    def append(self, code):
+        if code not in self.codes:
+            self.codes.add(code)
+            super().append(code)
+
+
+class SubsetCachingTTFontFile(TTFontFile):
+    """
+    TrueType parser memoizing font subsets in the cache of the document
+    being written. Subsetting re-reads the whole font file, while documents
+    of one renderer share the same subset. Other documents get no cache.
+    """
+
+    def makeSubset(self, file, subset):  # noqa: N802
+        subsets = font_subsets.get()
+        if subsets is None:
+            return super().makeSubset(file, subset)
+        key = (file, frozenset(subset))
+        if key not in subsets:
+            if len(subsets) >= PDF_FONT_SUBSETS_LIMIT:
+                subsets.clear()
+            stream = super().makeSubset(file, subset)
+            subsets[key] = (stream, self.codeToGlyph, self.maxUni)
+        stream, self.codeToGlyph, self.maxUni = subsets[key]
+        return stream
+
+
+# fpdf reads both from its module namespace and offers no arguments for
+# them, so they are set once on import: metrics stay in memory instead of
+# .pkl files next to the font, fonts are embedded by the caching parser
+set_global('FPDF_CACHE_MODE', PDF_FONT_CACHE_MODE_NONE)
+fpdf.fpdf.TTFontFile = SubsetCachingTTFontFile
+
+
+class ShopListDocument(FPDF):
+    """Document embedding fonts with subsets cached by its renderer"""
+
+    def __init__(self, subsets):
+        super().__init__()
+        self.subsets = subsets
+
+    def _putfonts(self):
+        token = font_subsets.set(self.subsets)
+        try:
+            super()._putfonts()
+        finally:
+            font_subsets.reset(token)
+
+
+class ShopListRenderer:
+    """
+    Shopping list PDF renderer, create it once per process.
+    The font is parsed on creation and every document embeds
+    the same charset subset, so a render only lays out its lines.
+    """
+
+    def __init__(self, font_name=PDF_FONT_NAME, charset=PDF_FONT_CHARSET):
+        template = FPDF()
+        template.add_font(PDF_FONT_FAMILY,
+                          PDF_FONT_STYLE,
+                          font_name,
+                          uni=True)
+        self.fonts = template.fonts
+        self.font_files = template.font_files
+        self.subset = (*PDF_FONT_CONTROL_CHARS, *map(ord, charset))
+        self.subsets = {}
+
+    def new_document(self):
+        pdf = ShopListDocument(self.subsets)
+        pdf.fonts = {key: dict(font, subset=FontSubset(self.subset))
+                     for key, font in self.fonts.items()}
+        pdf.font_files = {key: dict(font_file)
+                          for key, font_file in self.font_files.items()}
+        pdf.add_page()
+        pdf.set_font(PDF_FONT_FAMILY, size=PDF_FONT_SIZE)
+        return pdf
+
+    def render(self, user, ingredients):
+        """Render shopping list to PDF in memory, return its bytes"""
+        pdf = self.new_document()
         pdf.cell(
             PDF_CELL_WIDTH,
             PDF_CELL_HEGHT,
-            txt=PDF_INGREDIENT_LINE.format(name=name.capitalize(),
-                                           unit=unit,
-                                           amount=str(amount)),
-            align=PDF_ALIGN_LEFT,
+            txt=PDF_HEAD_LINE.format(name=user.first_name,
+                                     surname=user.last_name),
+            align=PDF_ALIGN_CENTER
         )
-        pdf.ln(PDF_LINE_BRAKE_SMALL)
-    pdf.output(pdf_name)
-    return pdf_name
+        pdf.ln(PDF_LINE_BRAKE_BIG)
+        for name, unit, amount in ingredients:
+            pdf.cell(
+                PDF_CELL_WIDTH,
+                PDF_CELL_HEGHT,
+                txt=PDF_INGREDIENT_LINE.format(name=name.capitalize(),
+                                               unit=unit,
+                                               amount=str(amount)),
+                align=PDF_ALIGN_LEFT,
+            )
+            pdf.ln(PDF_LINE_BRAKE_SMALL)
+        return pdf.output(
+            dest=PDF_OUTPUT_STRING
+        ).encode(PDF_OUTPUT_ENCODING)
+
+
+@lru_cache(maxsize=None)
+def get_shop_list_renderer():
+    return ShopListRenderer()
+
+
+def preload_shop_list_renderer():
+    """
+    Parse the font and embed its subset once, call it before workers fork
+    to share the result between them
+    """
+    try:
+        get_shop_list_renderer().render(PDF_PRELOAD_USER, ())
+    except RuntimeError:
+        logger.warning('Shopping list font %s not found', PDF_FONT_NAME)
+
+
+def create_shop_list(user, ingredients):
+    """Render shopping list to PDF in memory, return its bytes"""
+    return get_shop_list_renderer().render(user, ingredients)
+
+
+def stream_shop_list_csv(ingredients):
+    """Yield shopping list lines in CSV format one by one"""
+    writer = csv.writer(EchoBuffer())
+    yield writer.writerow(CSV_HEADER)
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def stream_shop_list_txt(user, ingredients):
+    """Yield shopping list lines as plain text one by one"""
+    yield TXT_LINE.format(line=PDF_HEAD_LINE.format(name=user.first_name,
+                                                    surname=user.last_name))
+    yield TXT_LINE.format(line='')
+    for name, unit, amount in ingredients:
+        yield TXT_LINE.format(line=PDF_INGREDIENT_LINE.format(
+            name=name.capitalize(),
+            unit=unit,
+            amount=amount,
+        ))
+
+
+def get_shop_list_pdf(user, cached=True):
+    """
+    Return rendered shopping list of user, render it only if the cart
+    has changed since the last call
+    """
+    if not cached:
+        return create_shop_list(user, aggregate_shop_list(user))
+    key = SHOP_LIST_CACHE_KEY.format(
+        user=user.id,
+        cart=get_cart_version(user.id),
+        ingredients=get_version(INGREDIENTS_VERSION),
+    )
+    pdf = cache.get(key)
+    record(SHOP_LIST_STATS, hit=pdf is not None)
+    if pdf is None:
+        with primary_reads():
+            pdf = create_shop_list(user, aggregate_shop_list(user))
+        cache.set(key, pdf, SHOP_LIST_CACHE_TIMEOUT)
+    return pdf
@@ -11,6 +11,8 @@ class UniqueManyFieldsValidator:
         self.message = message or self.message
 
     def __call__(self, attrs):
+        if self.many_field not in attrs:
+            return
         unique_in_many_field = set(
             attr[self.unique_subfield] for attr in attrs[self.many_field]
         ) if self.unique_subfield else set(attrs[self.many_field])
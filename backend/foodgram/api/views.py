@@ -1,10 +1,12 @@
-from wsgiref.util import FileWrapper
+import io
 
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef, Prefetch
 from django.db.models.expressions import Value
-from django.db.models.fields import IntegerField
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.db.models.fields import BooleanField
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser import views as djoser_views
 from rest_framework import status, viewsets
@@ -14,16 +16,33 @@ from rest_framework.permissions import (
 )
 from rest_framework.response import Response
 
+from .caches import (
+    FLAGS_VERSION, INGREDIENTS_VERSION, RECIPE_VERSION, RECIPES_VERSION,
+    TAGS_VERSION, USERS_VERSION,
+)
+from .fields import ImageUploadHandler
 from .filters import IngredientFilter, RecipeFilter
-from .models import Ingredient, Recipe, Subscription, Tag
-from .paginators import PageLimitPagination
+from .jobs import enqueue_shop_list
+from .mixins import (
+    AnonymousResponseCacheMixin, ConditionalResponseMixin,
+    RecipeFragmentCacheMixin, ReferenceSnapshotMixin, ReplicaReadMixin,
+)
+from .models import (
+    Ingredient, IngredientInRecipe, Recipe, ShopListJob, Subscription, Tag,
+)
+from .negotiation import FormatParamContentNegotiation
+from .paginators import PageOrCursorPagination
 from .permissions import IsAuthorOrReadOnly
+from .search import search_ingredients
 from .serializers import (
     IngredientSerializer, RecipeReadPartialSerializer, RecipeReadSerializer,
-    RecipeWriteSerializer, TagSerializer, UserSubscribeSerializer,
+    RecipeWriteSerializer, ShopListJobSerializer, TagSerializer,
+    UserSubscribeSerializer,
+)
+from .utils import (
+    aggregate_shop_list, get_shop_list_pdf, stream_shop_list_csv,
+    stream_shop_list_txt,
 )
-from .utils import create_shop_list
-from foodgram.settings import SHOPPING_CART_DIR
 
 ERROR_RECIPE_IN_CART = 'Рецепт {recipe} уже в корзине.'
 ERROR_RECIPE_NOT_IN_CART = 'Рецепта {recipe} нет в корзине.'
@@ -32,26 +51,46 @@ ERROR_RECIPE_NOT_IN_FAVORITE = 'Рецепта {recipe} нет в избранн
 ERROR_SUBSCRIBE_SELF = 'Невозможно подписаться на самого себя.'
 ERROR_SUBSCRIBE_AGAIN = 'Вы уже подписаны на {author}.'
 ERROR_UNSUBSCRIBE_AGAIN = 'Вы не подписаны на {author}.'
+ERROR_SHOP_LIST_FORMAT = (
+    'Неизвестный формат списка покупок: {format}. Доступны: {formats}.'
+)
+SHOP_LIST_FORMAT_PARAM = 'format'
+INGREDIENT_SEARCH_PARAM = 'name'
+SHOP_LIST_FILE_NAME = 'shopping_list.{format}'
+SHOP_LIST_CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'csv': 'text/csv; charset=utf-8',
+    'txt': 'text/plain; charset=utf-8',
+}
 
 User = get_user_model()
 
 
-class UserViewSet(djoser_views.UserViewSet):
+def annotate_is_subscribed(queryset, user):
+    """Annotate users with `is_subscribed` flag of the given subscriber"""
+    return queryset.annotate(
+        is_subscribed=Exists(Subscription.objects.filter(
+            author=OuterRef('pk'),
+            subscriber=user,
+        )) if user.is_authenticated
+        else Value(False, output_field=BooleanField())
+    )
+
+
+class UserViewSet(ReplicaReadMixin, djoser_views.UserViewSet):
     http_method_names = ['get', 'post', 'delete']
-    pagination_class = PageLimitPagination
+    primary_actions = ('subscribe',)
+    pagination_class = PageOrCursorPagination
+
+    @property
+    def cursor_ordering(self):
+        if self.action == 'subscriptions':
+            return ('username', 'id')
+        return None
 
     def get_queryset(self):
-        return (
-            super().get_queryset().annotate(
-                is_subscribed=Count(
-                    'subscribers',
-                    filter=Q(subscribers__subscriber=self.request.user)
-                ),
-            ) if self.request.user.is_authenticated
-            else super().get_queryset().annotate(
-                is_subscribed=Value(0, output_field=IntegerField())
-            )
-        )
+        return annotate_is_subscribed(super().get_queryset(),
+                                      self.request.user)
 
     def get_serializer_class(self):
         if self.action in ('subscriptions', 'subscribe'):
@@ -119,41 +158,116 @@ class UserViewSet(djoser_views.UserViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, ReferenceSnapshotMixin,
+                        ConditionalResponseMixin, AnonymousResponseCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
+    snapshot_version = INGREDIENTS_VERSION
+    conditional_versions = (INGREDIENTS_VERSION,)
+    response_cache_versions = (INGREDIENTS_VERSION,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(INGREDIENT_SEARCH_PARAM)
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(
+            self.get_serializer(search_ingredients(name), many=True).data
+        )
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReplicaReadMixin, ReferenceSnapshotMixin,
+                 ConditionalResponseMixin, AnonymousResponseCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
+    snapshot_version = TAGS_VERSION
+    conditional_versions = (TAGS_VERSION,)
+    response_cache_versions = (TAGS_VERSION,)
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, ConditionalResponseMixin,
+                    AnonymousResponseCacheMixin, RecipeFragmentCacheMixin,
+                    viewsets.ModelViewSet):
     permission_classes = (IsAuthorOrReadOnly, IsAuthenticatedOrReadOnly)
-    pagination_class = PageLimitPagination
+    pagination_class = PageOrCursorPagination
+    primary_actions = ('shopping_cart', 'favorite',
+                       'download_shopping_cart_job')
+    cursor_ordering = ('-pub_date', '-id')
+    response_cache_versions = (RECIPES_VERSION, TAGS_VERSION,
+                               INGREDIENTS_VERSION, USERS_VERSION)
+    conditional_versions = (*response_cache_versions, FLAGS_VERSION)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_recipe_pk(self):
+        """Primary key of the requested recipe, 404 if it is malformed"""
+        try:
+            return Recipe._meta.pk.to_python(self.kwargs['pk'])
+        except ValidationError:
+            raise Http404
+
+    def get_conditional_versions(self):
+        versions = super().get_conditional_versions()
+        if self.action != 'retrieve':
+            return versions
+        return [RECIPE_VERSION.format(recipe=self.get_recipe_pk())
+                if name == RECIPES_VERSION else name
+                for name in versions]
+
+    def get_validators(self):
+        """Detail of a recipe is also validated by its modification time"""
+        versions, last_modified = super().get_validators()
+        if self.action != 'retrieve':
+            return versions, last_modified
+        modified = Recipe.objects.filter(
+            pk=self.get_recipe_pk()
+        ).values_list('modified', flat=True).first()
+        if modified is None:
+            return versions, last_modified
+        return ([*versions, modified.timestamp()],
+                max(last_modified, modified.timestamp()))
+
+    def initialize_request(self, request, *args, **kwargs):
+        """Images of forms are streamed to disk and checked on the way"""
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
     def get_queryset(self):
-        return (
-            Recipe.objects.annotate(
-                is_favorited=Count(
-                    'users_have_in_favorite',
-                    filter=Q(users_have_in_favorite=self.request.user)
+        user = self.request.user
+        if not user.is_authenticated:
+            queryset = Recipe.objects.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        else:
+            queryset = Recipe.objects.annotate(
+                is_favorited=Exists(
+                    User.favorite_recipes.through.objects.filter(
+                        user=user,
+                        recipe=OuterRef('pk'),
+                    )
+                ),
+                is_in_shopping_cart=Exists(
+                    User.shopping_cart_recipes.through.objects.filter(
+                        user=user,
+                        recipe=OuterRef('pk'),
+                    )
                 ),
-                is_in_shopping_cart=Count(
-                    'users_have_in_shopping_cart',
-                    filter=Q(users_have_in_shopping_cart=self.request.user)
-                )
-            ).prefetch_related('tags', 'ingredients')
-            if self.request.user.is_authenticated
-            else Recipe.objects.annotate(
-                is_favorited=Value(0, output_field=IntegerField()),
-                is_in_shopping_cart=Value(0, output_field=IntegerField()),
-            ).prefetch_related('tags', 'ingredients')
+            )
+        return queryset.prefetch_related(*self.get_prefetch_lookups())
+
+    def get_prefetch_lookups(self):
+        return (
+            'tags',
+            Prefetch(
+                'ingredientinrecipe_set',
+                IngredientInRecipe.objects.select_related('ingredient'),
+            ),
+            Prefetch('author', annotate_is_subscribed(User.objects,
+                                                      self.request.user)),
         )
 
     def filter_queryset(self, queryset):
@@ -165,11 +279,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.flattened_errors,
                             status=status.HTTP_400_BAD_REQUEST)
         self.perform_create(serializer)
+        recipe = serializer.instance
+        # Nobody could favorite the recipe yet, authors can't subscribe
+        # to themselves, the rest of the response is already in memory
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author.is_subscribed = False
         return Response(
-            RecipeReadSerializer(
-                get_object_or_404(self.get_queryset(),
-                                  id=serializer.instance.id),
-            ).data,
+            RecipeReadSerializer(recipe).data,
             status=status.HTTP_201_CREATED,
         )
 
@@ -181,46 +297,70 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.flattened_errors,
                             status=status.HTTP_400_BAD_REQUEST)
         self.perform_update(serializer)
+        # The recipe was read with its flags and relations, the serializer
+        # has replaced the written ones with the new values
         return Response(
-            RecipeReadSerializer(
-                get_object_or_404(self.get_queryset(),
-                                  id=serializer.instance.id),
-            ).data,
+            RecipeReadSerializer(serializer.instance).data,
             status=status.HTTP_200_OK,
         )
 
     @action(('get',), detail=False,
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            content_negotiation_class=FormatParamContentNegotiation)
     def download_shopping_cart(self, request, *args, **kwargs):
-        ingredients = {}
-        for name, unit, amount in (
-            (ingredient['name'],
-             ingredient['measurement_unit'],
-             ingredient['amount'])
-            for ingredient in (
-                item for sublist in (
-                    recipe['ingredients']
-                    for recipe in self.get_serializer(
-                        self.get_queryset().filter(is_in_shopping_cart=True),
-                        many=True,
-                    ).data
-                ) for item in sublist
+        format = request.query_params.get(SHOP_LIST_FORMAT_PARAM, 'pdf')
+        if format not in SHOP_LIST_CONTENT_TYPES:
+            return Response(
+                data={'errors': ERROR_SHOP_LIST_FORMAT.format(
+                    format=format,
+                    formats=', '.join(SHOP_LIST_CONTENT_TYPES),
+                )},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-        ):
-            ingredients[(name, unit)] = (
-                ingredients.setdefault((name, unit), 0) + amount
+        filename = SHOP_LIST_FILE_NAME.format(format=format)
+        if format == 'pdf':
+            return FileResponse(
+                io.BytesIO(get_shop_list_pdf(request.user)),
+                as_attachment=True,
+                filename=filename,
+                content_type=SHOP_LIST_CONTENT_TYPES[format],
             )
-        cart = open(
-            create_shop_list(SHOPPING_CART_DIR
-                             + f'{request.user.username}_cart.pdf',
-                             request.user,
-                             ingredients),
-            'rb',
+        ingredients = aggregate_shop_list(request.user)
+        response = StreamingHttpResponse(
+            stream_shop_list_csv(ingredients) if format == 'csv'
+            else stream_shop_list_txt(request.user, ingredients),
+            content_type=SHOP_LIST_CONTENT_TYPES[format],
         )
-        return HttpResponse(
-            FileWrapper(cart),
-            content_type='application/pdf',
-            status=status.HTTP_200_OK,
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"'
+        )
+        return response
+
+    @download_shopping_cart.mapping.post
+    def enqueue_shopping_cart(self, request, *args, **kwargs):
+        return Response(
+            ShopListJobSerializer(enqueue_shop_list(request.user)).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(('get',), detail=False,
+            permission_classes=[IsAuthenticated],
+            url_path=r'download_shopping_cart/(?P<job_id>[0-9]+)',
+            url_name='download-shopping-cart-job')
+    def download_shopping_cart_job(self, request, job_id, *args, **kwargs):
+        job = get_object_or_404(ShopListJob, id=job_id, user=request.user)
+        if job.status != ShopListJob.Status.DONE:
+            return Response(
+                ShopListJobSerializer(job).data,
+                status=(status.HTTP_200_OK
+                        if job.status == ShopListJob.Status.FAILED
+                        else status.HTTP_202_ACCEPTED),
+            )
+        return FileResponse(
+            io.BytesIO(job.result),
+            as_attachment=True,
+            filename=SHOP_LIST_FILE_NAME.format(format='pdf'),
+            content_type=SHOP_LIST_CONTENT_TYPES['pdf'],
         )
 
     @action(('get',), detail=True,
@@ -63,6 +63,38 @@ DATABASES = {
         'PORT': os.environ.get('DB_PORT'),
     }
 }
+# Read replicas, comma separated hosts with the same database and users
+DATABASES.update({
+    f'replica{number}': {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+    for number, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1
+    )
+})
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Seconds users read from the primary after their writes, above the lag
+PRIMARY_PIN_TIMEOUT = int(os.environ.get('PRIMARY_PIN_TIMEOUT', 10))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', default=''),
+    }
+}
+# Versions of cached data, token auth versions and replica pins are seen
+# by every process only in a shared cache, see api/checks.py
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+SHARED_CACHE = CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -97,6 +129,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'backend_static')
 
 MEDIA_URL = '/backend_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'backend_media')
+# Processes resizing recipe images, 0 resizes them in the request
+IMAGE_RENDITION_WORKERS = int(os.environ.get('IMAGE_RENDITION_WORKERS', 2))
+# Largest recipe image accepted, in bytes
+RECIPE_IMAGE_MAX_SIZE = int(os.environ.get('RECIPE_IMAGE_MAX_SIZE',
+                                           20 * 1024 * 1024))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -105,9 +142,17 @@ AUTH_USER_MODEL = 'api.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 }
+# Users kept by tokens in memory of each worker, and in the shared cache
+# if TOKEN_CACHE_SHARED is set. Without a shared cache other workers do not
+# see logouts and password changes, so users are kept only for seconds
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.environ.get(
+    'TOKEN_CACHE_TIMEOUT', 300 if SHARED_CACHE else 5
+))
+TOKEN_CACHE_SHARED = (os.environ.get('TOKEN_CACHE_SHARED') == 'True')
 
 DJOSER = {
     'PERMISSIONS': {
@@ -120,5 +165,3 @@ DJOSER = {
     },
     'HIDE_USERS': False,
 }
-
-SHOPPING_CART_DIR = os.path.join(BASE_DIR, 'carts/')
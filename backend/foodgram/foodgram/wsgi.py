@@ -1,7 +1,16 @@
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.db import connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+from api.search import preload_ingredient_index  # noqa: E402, I001
+from api.utils import preload_shop_list_renderer  # noqa: E402, I001
+
+preload_shop_list_renderer()
+preload_ingredient_index()
+# Workers forked by gunicorn --preload must not share the connection
+connections.close_all()